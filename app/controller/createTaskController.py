@@ -6,9 +6,11 @@ from utils.utils import Utils
 
 
 class CreateTaskController:
-    def __init__(self, view, ws_client):
+    def __init__(self, view, ws_client, on_sent=None):
         self.view = view
         self.ws_client = ws_client
+        # Called with (action, params, future) after sending, to show it right away
+        self.on_sent = on_sent
 
         # Load config.json for the machine, materials and speeds settings
         self.config = Utils.load_config()
@@ -69,8 +71,16 @@ class CreateTaskController:
         )
 
         # Send the task to the server via WebSocket
-        self.ws_client.send("create", task.__dict__)
-        messagebox.showinfo("Success", "Task creation requested!")
+        params = dict(task.__dict__)
+        future = self.ws_client.send("create", params)
+        if self.on_sent:
+            self.on_sent("create", params, future)
+        Utils.show_reply(
+                self.view.master,
+                future,
+                "Task {task_id} created!",
+                "The task was not created"
+        )
 
         # Clear the input fields after task creation
         self.view.machine_combo.set("")
@@ -1,11 +1,13 @@
-from tkinter import messagebox
+from utils.utils import Utils
 
 
 class DeleteTaskController:
-    def __init__(self, view, ws_client, task):
+    def __init__(self, view, ws_client, task, on_sent=None):
         self.view = view
         self.ws_client = ws_client
         self.task = task
+        # Called with (action, params, future) after sending, to show it right away
+        self.on_sent = on_sent
 
         # Show the values of the task
         self._set_values()
@@ -30,7 +32,15 @@ class DeleteTaskController:
         Tells the WebSocket client to send a signal to the WebSocket server for deleting the task.
         Closes the window after.
         """
-        self.ws_client.send("delete", {"task_id": self.task.task_id})
-        messagebox.showinfo("Success", "Task deleted successfully!")
+        params = {"task_id": self.task.task_id}
+        future = self.ws_client.send("delete", params)
+        if self.on_sent:
+            self.on_sent("delete", params, future)
+        Utils.show_reply(
+                self.view.master,
+                future,
+                "Task deleted successfully!",
+                "The task was not deleted"
+        )
         
-        self.view.destroy()
\ No newline at end of file
+        self.view.destroy()
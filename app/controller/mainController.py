@@ -1,30 +1,44 @@
-from datetime import datetime
+import itertools
 from tkinter import messagebox
-import tkinter as tk
 
 from controller.createTaskController import CreateTaskController
 from controller.modifyTaskController import ModifyTaskController
 from controller.deleteTaskController import DeleteTaskController
+from model.taskManager import TaskManager
 from model.taskModel import TaskModel
+from utils.utils import Utils
 from view.createTaskView import CreateTaskView
 from view.modifyTaskView import ModifyTaskView
 from view.deleteTaskView import DeleteTaskView
 
 
 class MainController:
-    def __init__(self, view, ws_client):
+    def __init__(self, view, ws_client, countdown_interval=1000):
         self.view = view
         self.ws_client = ws_client
+        # Milliseconds between refreshes of the "Time left" countdown
+        self.countdown_interval = countdown_interval
         self.sort_order = {}
         # Task instance
         self.task = TaskModel()
         self.previous_tasks = {}
+        # Temporary ids of the rows of tasks being created
+        self._pending_ids = itertools.count(1)
 
         # Callbacks
         self.view.set_on_create_task(self.open_create_task_view)
         self.view.set_on_modify_task(self.open_modify_task_view)
         self.view.set_on_delete_task(self.open_delete_task_view)
         self.view.set_on_column_click(self.sort_table_by_column)
+        self.view.set_on_filter(self.filter_table)
+
+        # Options of the filter bar
+        config = Utils.load_config()
+        self.view.set_filter_options(
+                [machine["name"] for machine in config["machines"]],
+                [material["name"] for material in config["materials"]],
+                ["On queue", "In progress", "Completed"]
+        )
 
         # Countdown refresher starts with the client
         self._start_countdown_refresher()
@@ -36,7 +50,8 @@ class MainController:
         create_view = CreateTaskView(self.view.window)
         CreateTaskController(
                 create_view,
-                self.ws_client
+                self.ws_client,
+                self.show_sent_operation
         )
 
     def open_modify_task_view(self):
@@ -64,7 +79,8 @@ class MainController:
                 ModifyTaskController(
                         modify_view,
                         self.ws_client,
-                        self.task
+                        self.task,
+                        self.show_sent_operation
                 )
 
     def open_delete_task_view(self):
@@ -91,9 +107,69 @@ class MainController:
                 DeleteTaskController(
                         delete_view,
                         self.ws_client,
-                        self.task
+                        self.task,
+                        self.show_sent_operation
                 )
 
+    # Optimistic updates
+    def show_sent_operation(self, action, params, future):
+        """
+        Show an operation on the table as soon as it is sent, marked as pending.
+        When the server answers it is confirmed or, if rejected, rolled back
+        (the task controller shows the server's message).
+        """
+        table_model = self.view.table_model
+        if action == "create":
+            # The server decides the task_id, a temporary one is shown meanwhile
+            task_id = f"pending-{next(self._pending_ids)}"
+            table_model.apply_local(
+                    task_id,
+                    TaskModel(**dict(params, task_id=task_id)).to_row()
+            )
+        elif action == "update":
+            task_id = params["task_id"]
+            row = table_model.get(task_id)
+            if row is None:
+                return
+            task = TaskModel.from_row(row)
+            # Same changes the server calculates
+            for field, value in TaskManager.update_changes(params).items():
+                setattr(task, field, value)
+            table_model.apply_local(task_id, task.to_row())
+        elif action == "delete":
+            task_id = params["task_id"]
+            table_model.apply_local(task_id, None)
+        else:
+            return
+        self.view.refresh()
+        Utils.when_done(
+                self.view.window,
+                future,
+                lambda future: self._reconcile_operation(action, task_id, future)
+        )
+
+    def _reconcile_operation(self, action, task_id, future):
+        """Confirm or roll back an optimistic change once the server answered."""
+        table_model = self.view.table_model
+        if future.exception() is not None:
+            table_model.revert_local(task_id)
+        elif action == "create":
+            # The temporary row stays until the one with the server's task_id arrives
+            table_model.confirm_created(task_id, future.result()["task_id"])
+        else:
+            table_model.confirm_local(task_id)
+        self.view.refresh()
+        self.view.set_status(self.latency_text())
+
+    def latency_text(self):
+        """Round trips of the operations sent from here (p50/p95/p99, ms)."""
+        summary = self.ws_client.latency.summary()
+        return "   ".join(
+                f"{action}: p50 {stats['p50']:.0f} / p95 {stats['p95']:.0f} "
+                f"/ p99 {stats['p99']:.0f} ms ({stats['count']})"
+                for action, stats in summary.items()
+        )
+
     # Other functions
     def select_item(self):
         """Returns the selected row in the table as tuple."""
@@ -121,8 +197,9 @@ class MainController:
 
     def sort_table_by_column(self, column):
         """
-        Sort table by the column (ascending and descending) using only the data in the Treeview.
-        Handles mixed types in the Status column: 'On queue' > int > 'Completed'.
+        Sort table by the column (ascending and descending).
+        The table model keeps the order while updates arrive,
+        the view only moves the rows of the visible window.
         """
         column_indices = {
             "Task ID": 0,
@@ -135,100 +212,67 @@ class MainController:
         }
         col_index = column_indices[column]
 
-        # Get the data from the table
-        items = self.view.tree.get_children()
-        # List of lists. Sublist has the values of a row
-        rows = [self.view.tree.item(item)["values"] for item in items]
-        
         # Toggles the order on click
         self.sort_order[column] = not self.sort_order.get(column, False)
         reverse = not self.sort_order[column]
 
+        self.view.table_model.sort_by(col_index, reverse)
+        self.view.refresh()
 
-        def started_at_sort_key(value):
-            #Custom sort for when it's empty and when it has values
-            if value == "":
-                return (0,0)
-            else:
-                return (1, value)
-
-        def status_sort_key(value):
-            # Custom sort: 'On queue' > int > 'Completed'
-            # It will sort by the first value on the tuple
-            # and after that, by the second one
-                # Example: On queue > In progress > Completed
-            if value == "On queue":
-                return (2, 0)
-            if value == "In progress":
-                return (1, 0)
-            if value == "Completed":
-                return (0, 0)
-            
-        def time_left_sort_key(value):
-            # Same concept as above, but ordering from higher to lower, then no time remaining.
-                # Example: 42 > 21 > 2 > ""
-            if isinstance(value, int):
-                return (1, value)
-            if value == "":
-                return (0, 0)
-
-        # If sorting by started at, use the custom sort above
-        if column == "Started at":
-            sorted_rows = sorted(
-                    rows,
-                    key=lambda x: started_at_sort_key(x[col_index]),
-                    reverse=reverse
-            )        
-        # If sorting by status, use the custom sort above
-        elif column == "Status":
-            sorted_rows = sorted(
-                    rows,
-                    key=lambda x: status_sort_key(x[col_index]),
-                    reverse=reverse
+    def filter_table(self):
+        """
+        Filter the table with the values of the filter bar.
+        Every filter is combined with the others; empty ones are ignored.
+        """
+        filters = self.view.get_filters()
+        try:
+            speed = (
+                int(filters["speed_min"]) if filters["speed_min"] else None,
+                int(filters["speed_max"]) if filters["speed_max"] else None
             )
-        # If sorting by time left, use the custom sort above
-        elif column == "Time left":
-            sorted_rows = sorted(
-                    rows,
-                    key=lambda x: time_left_sort_key(x[col_index]),
-                    reverse=reverse
+        except ValueError:
+            messagebox.showerror("Input error", "Speed must be a valid number.")
+            return
+        try:
+            started_at = (
+                Utils.parse_timestamp(filters["started_from"])
+                        if filters["started_from"] else None,
+                Utils.parse_timestamp(filters["started_to"], end_of_day=True)
+                        if filters["started_to"] else None
             )
-        else:
-            sorted_rows = sorted(
-                    rows,
-                    key=lambda x: x[col_index],
-                    reverse=reverse
+        except ValueError:
+            messagebox.showerror(
+                    "Input error",
+                    "Dates must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS."
             )
-        
-        for item in items:
-            self.view.tree.delete(item)
-        for row in sorted_rows:
-            self.view.tree.insert("", tk.END, values=row)
+            return
+
+        self.view.table_model.set_filters(
+                task_id=filters["task_id"],
+                machine=filters["machine"],
+                material=filters["material"],
+                status=filters["status"],
+                speed=speed,
+                started_at=started_at
+        )
+        # Go back to the first row of the filtered table
+        self.view.first_row = 0
+        self.view.refresh()
 
     # Countdown logic for the client side
     def _start_countdown_refresher(self):
-        "Start the countdown every 5 seconds after the client connects to the server."
-        self.view.window.after(5000, self._countdown_refresher)
+        "Start the countdown after the client connects to the server."
+        self.view.window.after(self.countdown_interval, self._countdown_refresher)
 
     def _countdown_refresher(self):
         """
-        Iterate over all the rows and decrement the "Time left" for ongoing tasks.
+        Update the "Time left" of the running tasks that are on the Treeview.
+        Only the index of running tasks is walked, never the whole history,
+        and a row is only written if its shown value changed.
         """
-        for item in self.view.tree.get_children():
-            values = list(self.view.tree.item(item, "values"))
-
-            try:
-                if values[5] == "In progress":
-                    time_expected = values[7]
-                    time_left = (
-                            datetime.strptime(time_expected, "%Y-%m-%d %H:%M:%S.%f")
-                            - datetime.now()
-                            ).total_seconds()
-                    seconds_left = int(time_left)
-
-                    values[6] = seconds_left
-                    self.view.tree.item(item, values=values)
-            except Exception:
-                continue
-        # Next refresh in 5 seconds
-        self.view.window.after(5000, self._countdown_refresher)
\ No newline at end of file
+        table_model = self.view.table_model
+        for task_id in table_model.running:
+            if self.view.is_shown(task_id):
+                self.view.upsert_task(table_model.get(task_id))
+        # Next refresh
+        self.view.window.after(self.countdown_interval, self._countdown_refresher)
@@ -1,16 +1,15 @@
-from datetime import datetime
 from tkinter import messagebox
 
 from utils.utils import Utils
 
 
 class ModifyTaskController:
-    def __init__(self, view, ws_client, task):
+    def __init__(self, view, ws_client, task, on_sent=None):
         self.view = view
         self.ws_client = ws_client
         self.task = task
-        # Used to calculate the delta between opening the view and sending the update
-        self.controller_call_timestamp = datetime.now()
+        # Called with (action, params, future) after sending, to show it right away
+        self.on_sent = on_sent
 
         # Load config.json for the machine, materials and speeds settings
         self.config = Utils.load_config()      
@@ -91,7 +90,7 @@ class ModifyTaskController:
         Tasks that haven't started ("On queue") yet can be fully modified.
         Tasks that are "In progress" can only have speed modified (recalculated).
         Tasks that are "Completed" cannot be modified.
-        Recalculates the time left.
+        The server recalculates the time left with its own clock.
         """
         try:
             if self.task.status == "On queue":
@@ -104,18 +103,13 @@ class ModifyTaskController:
             old_speed = self.task.speed
             new_speed = self.view.speed_entry.get()
 
-            # Calculate the delta between opening the view and sending the update
-            current_time = datetime.now()
-            time_passed = self.controller_call_timestamp - current_time
-            new_time_left = int(self.task.time_left) + int(time_passed.total_seconds())
-
             # Dict that will be passed as param
             updating_dict = {
                     "machine": machine,
                     "material": material,
                     "old_speed": str(old_speed),
                     "new_speed": str(new_speed),
-                    "time_left": new_time_left,
+                    "time_left": int(self.task.time_left),
                     "task_id": self.task.task_id,
             }
 
@@ -127,8 +121,15 @@ class ModifyTaskController:
                 return
 
             # Update task on the DB
-            self.ws_client.send("update", updating_dict)            
-            messagebox.showinfo("Success", "Task modified.")
+            future = self.ws_client.send("update", updating_dict)
+            if self.on_sent:
+                self.on_sent("update", updating_dict, future)
+            Utils.show_reply(
+                    self.view.master,
+                    future,
+                    "Task modified.",
+                    "The task was not modified"
+            )
 
             self.view.destroy()
 
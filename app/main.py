@@ -1,71 +1,57 @@
-from datetime import datetime
-import time
-import socket
-import threading
+import subprocess
+import sys
 
 import tkinter as tk
 
 from controller.mainController import MainController
-from utils.wss import WebSocketServer, WebSocketClient
+from model.taskTableModel import TaskTableModel
+from utils.dispatcher import TkDispatcher
+from utils.utils import Utils
+from utils.wss import WebSocketClient
 from view.mainView import MainView
 
 if __name__ == "__main__":
     root = tk.Tk()
-    main_view = MainView(root)
+    # Every task received is kept on the model, the view shows a window of it
+    table_model = TaskTableModel()
+    main_view = MainView(root, table_model)
 
     # Callback to update the main view when new state arrives from server
-    def update_view_from_server(tasks):
-        main_view.populate_table(tasks)
-
-    # Try to connect as a client.
-    # If it fails, start server, then connect as client.
-    def is_server_running(host='localhost', port=8765):
-        try:
-            # Create a connection after 0.1s
-            with socket.create_connection((host, port), timeout=0.1):
-                return True
-        except Exception:
-            return False
-
-    if not is_server_running():
-        # Start server in another thread if there is no server running
-        server = WebSocketServer()
-        threading.Thread(
-                target=server.run,
-                daemon=True
-        ).start()
-        # Wait for the server to start
-        time.sleep(0.5)
-
-    # Start client
-    ws_client = WebSocketClient(update_view_from_server)
+    # Runs on the Tk thread, once per frame, with the merged messages
+    def update_view_from_server(messages):
+        for message in messages:
+            table_model.apply_message(message)
+        main_view.refresh()
+
+    # Messages arrive on the client's thread, the dispatcher
+    # hands them to the Tk thread
+    dispatcher = TkDispatcher(root, update_view_from_server)
+
+    # Start client. It keeps retrying (with backoff) until the server is up,
+    # the table fills in with the first state it receives
+    server_config = Utils.load_server_config()
+    ws_client = WebSocketClient(
+            dispatcher.push,
+            server_config["host"],
+            server_config["port"]
+    )
+    if not ws_client.wait_connected(timeout=0.5):
+        # No server yet: start one on its own process (app/server.py),
+        # so it keeps running when this window closes
+        print("No server running, starting one")
+        subprocess.Popen(
+                [sys.executable, "app/server.py"],
+                start_new_session=True
+        )
 
     # Instantiate MainController, passing ws_client for downstream use
     controller = MainController(main_view, ws_client)
 
     def on_close():
-        """Gather all ongoing tasks and their actual time_left BEFORE the server closes."""
-        tasks_to_save = []
-        for item in main_view.tree.get_children():
-            values = list(main_view.tree.item(item, "values"))
-            try:
-                if values[5] == "In progress":
-                    time_left = int(
-                            (
-                                datetime.strptime(values[7], "%Y-%m-%d %H:%M:%S.%f")
-                                - datetime.now()
-                            ).total_seconds()
-                            )
-                    tasks_to_save.append({
-                        "task_id": values[0],
-                        "time_left": time_left
-                    })
-            except Exception:
-                continue
-        if tasks_to_save:
-            ws_client.send("save_time_left", {"tasks": tasks_to_save})
-            time.sleep(1)
-        # Close the websocket connection
+        """
+        Close the connection. The server keeps running for the other windows
+        (stop it with Ctrl+C or SIGTERM, it saves the running tasks itself).
+        """
         ws_client.close()
         root.destroy()
 
@@ -0,0 +1,164 @@
+from bisect import bisect_left, bisect_right, insort
+
+# Index of every filtered column on a row
+TASK_ID_COLUMN = 0
+STARTED_AT_COLUMN = 1
+MACHINE_COLUMN = 2
+MATERIAL_COLUMN = 3
+SPEED_COLUMN = 4
+STATUS_COLUMN = 5
+
+# Filters that match a single value, and their column
+VALUE_FILTERS = {
+    "machine": MACHINE_COLUMN,
+    "material": MATERIAL_COLUMN,
+    "status": STATUS_COLUMN,
+}
+# Filters that match a (min, max) range, and their column
+RANGE_FILTERS = {
+    "speed": SPEED_COLUMN,
+    "started_at": STARTED_AT_COLUMN,
+}
+
+
+class TaskFilter:
+    """
+    Inverted indexes over the rows of the table, used to filter them.
+    - machine, material and status: value -> set of task_ids.
+    - speed and started at: (value, task_id) sorted, for ranges.
+    - task_id: sorted, for prefixes.
+    Active filters are combined (AND). The indexes follow every change,
+    so a filter is applied without going over all the rows.
+    """
+    def __init__(self):
+        # "machine" -> {value: set of task_ids}
+        self.values = {name: {} for name in VALUE_FILTERS}
+        # "speed" -> [(value, task_id)] sorted
+        self.ranges = {name: [] for name in RANGE_FILTERS}
+        self.task_ids = []
+        # name -> value, (min, max) or prefix. Only active filters are kept
+        self.filters = {}
+
+
+    def __bool__(self):
+        """True if any filter is active."""
+        return bool(self.filters)
+
+    def set_filters(self, **filters):
+        """
+        Replace the active filters. Empty values (None, "") are ignored.
+        - machine, material, status: the exact value.
+        - speed, started_at: (min, max), any of them can be None.
+        - task_id: a prefix.
+        """
+        self.filters = {}
+        for name, value in filters.items():
+            if name not in VALUE_FILTERS and name not in RANGE_FILTERS and name != "task_id":
+                raise ValueError(f"Unknown filter: {name}")
+            if name in RANGE_FILTERS:
+                if value is None or (value[0] is None and value[1] is None):
+                    continue
+            elif value in (None, ""):
+                continue
+            self.filters[name] = value
+
+    # Keeping the indexes
+    def add(self, task):
+        task_id = task[TASK_ID_COLUMN]
+        for name, column in VALUE_FILTERS.items():
+            self.values[name].setdefault(task[column], set()).add(task_id)
+        for name, column in RANGE_FILTERS.items():
+            if task[column] is not None:
+                insort(self.ranges[name], (task[column], task_id))
+        insort(self.task_ids, task_id)
+
+    def remove(self, task):
+        task_id = task[TASK_ID_COLUMN]
+        for name, column in VALUE_FILTERS.items():
+            ids = self.values[name].get(task[column])
+            if ids is not None:
+                ids.discard(task_id)
+                if not ids:
+                    del self.values[name][task[column]]
+        for name, column in RANGE_FILTERS.items():
+            if task[column] is not None:
+                entries = self.ranges[name]
+                del entries[bisect_left(entries, (task[column], task_id))]
+        del self.task_ids[bisect_left(self.task_ids, task_id)]
+
+    def update(self, old_task, task):
+        """Reindex a task only if a filtered column changed."""
+        if old_task is not None:
+            if all(old_task[column] == task[column] for column in (
+                    TASK_ID_COLUMN, STARTED_AT_COLUMN, MACHINE_COLUMN,
+                    MATERIAL_COLUMN, SPEED_COLUMN, STATUS_COLUMN)):
+                return
+            self.remove(old_task)
+        self.add(task)
+
+    def load(self, tasks):
+        """Rebuild every index from all the rows (sorting once)."""
+        self.values = {name: {} for name in VALUE_FILTERS}
+        for task in tasks:
+            for name, column in VALUE_FILTERS.items():
+                self.values[name].setdefault(task[column], set()).add(task[TASK_ID_COLUMN])
+        self.ranges = {
+            name: sorted(
+                    (task[column], task[TASK_ID_COLUMN])
+                    for task in tasks if task[column] is not None
+            )
+            for name, column in RANGE_FILTERS.items()
+        }
+        self.task_ids = sorted(task[TASK_ID_COLUMN] for task in tasks)
+
+    # Filtering
+    def matches(self, task):
+        """True if a single row passes every active filter."""
+        for name, value in self.filters.items():
+            if name in VALUE_FILTERS:
+                if task[VALUE_FILTERS[name]] != value:
+                    return False
+            elif name in RANGE_FILTERS:
+                current = task[RANGE_FILTERS[name]]
+                low, high = value
+                if current is None:
+                    return False
+                if low is not None and current < low:
+                    return False
+                if high is not None and current > high:
+                    return False
+            elif not task[TASK_ID_COLUMN].startswith(value):
+                return False
+        return True
+
+    def matching_ids(self):
+        """
+        Set of task_ids that pass every active filter (None if there are none).
+        Every filter gives a set from its index; the smallest goes first.
+        """
+        if not self.filters:
+            return None
+        candidates = sorted(
+                (self._ids_for(name, value) for name, value in self.filters.items()),
+                key=len
+        )
+        result = set(candidates[0])
+        for ids in candidates[1:]:
+            if not result:
+                break
+            result &= ids
+        return result
+
+    def _ids_for(self, name, value):
+        if name in VALUE_FILTERS:
+            return self.values[name].get(value, set())
+        if name in RANGE_FILTERS:
+            entries = self.ranges[name]
+            low, high = value
+            # task_ids are str, so "" goes before any of them
+            start = 0 if low is None else bisect_left(entries, (low, ""))
+            end = len(entries) if high is None else bisect_right(entries, (high, "\uffff"))
+            return {task_id for _, task_id in entries[start:end]}
+        start = bisect_left(self.task_ids, value)
+        end = bisect_left(self.task_ids, value + "\uffff")
+        return set(self.task_ids[start:end])
@@ -1,5 +1,20 @@
-from datetime import datetime, timedelta
-from model.taskModel import TaskModel
+from utils.utils import Utils
+
+# Columns of the tasks table that can be changed after creation
+TASK_FIELDS = (
+    "timestamp_start",
+    "machine",
+    "material",
+    "speed",
+    "status",
+    "time_left",
+    "timestamp_expected_complete",
+    "surface",
+)
+# Columns the "query" action can sort by
+SORT_FIELDS = ("task_id",) + TASK_FIELDS
+# Maximum number of rows of a single page
+QUERY_MAX_LIMIT = 500
 
 
 class TaskManager:
@@ -7,6 +22,16 @@ class TaskManager:
         self.db_manager = db_manager
 
 
+    def batch(self):
+        """
+        Unit of work for several operations:
+            with task_manager.batch():
+                ...
+        Everything inside is committed together (or not at all).
+        """
+        return self.db_manager.transaction()
+
+
     # Basic CRUD functions
     def create_task(self, task_model):
         """Create a task on the DB."""
@@ -29,61 +54,6 @@ class TaskManager:
             print(f"Error creating a task: {e}")
             raise RuntimeError("Failed to create the task")
 
-    def read_task(self, task_id):
-        """Reads a selected task from the DB and returns it."""
-        try:
-            query = "SELECT * FROM tasks WHERE task_id = ?"
-            result = self.db_manager.execute_query(query, (task_id,))
-            # Convert this list into a TaskModel and return it
-            task = TaskModel(
-                result[0][0],
-                result[0][1],
-                result[0][2],
-                result[0][3],
-                result[0][4],
-                result[0][5],
-                result[0][6],
-                result[0][7],
-            )
-            return task
-        except Exception as e:
-            print(f"Error reading task: {e}")
-            raise RuntimeError("Failed to read the task")
-
-    def update_task(self, params_dict):
-        """
-        Modifies the task on the DB.
-        Requires a tuple with the values of the fields that are modified.
-        """
-        old_speed = int(params_dict["old_speed"])
-        new_speed = int(params_dict["new_speed"])
-        old_time_left = int(params_dict["time_left"])
-        new_time_left = int(old_time_left * old_speed / new_speed)
-        new_expected_complete = datetime.now() + timedelta(seconds=new_time_left)
-
-        params_tuple = (
-                params_dict["machine"],
-                params_dict["material"],
-                new_speed,
-                new_time_left,
-                new_expected_complete,
-                params_dict["task_id"],
-        )
-        try:
-            query = """
-                    UPDATE tasks
-                    SET machine = ?,
-                        material = ?,
-                        speed = ?,
-                        time_left = ?,
-                        timestamp_expected_complete = ?
-                    WHERE task_id = ?
-                    """
-            self.db_manager.execute_query(query, params_tuple)
-        except Exception as e:
-            print(f"Error updating task: {e}")
-            raise RuntimeError("Failed to update the task")
-
     def delete_task(self, task_id):
         """Deletes the task from the DB."""
         try:
@@ -105,66 +75,156 @@ class TaskManager:
             print(f"Error fetching all the tasks: {e}")
             raise RuntimeError("Failed to fetch all the tasks")
         
-    def update_task_start_parameters(self, time_left, task_id):
+    def query_tasks(self, filters=None, sort="task_id", descending=False,
+                offset=0, limit=100):
         """
-        Updates a tasks timestamp_start, status and 
-        timestamp_expected_complete.
+        Reads a page of tasks and the total number of tasks that pass the filters.
+        - filters: dict with any of
+            task_id (prefix), machine, material, status (a value or a list),
+            speed and started_at ([min, max], any of them can be None).
+        - sort: a column of the table, task_id breaks the ties.
+        - offset and limit: the page (limit is capped at QUERY_MAX_LIMIT).
+        Returns (list of rows, total).
         """
-        now = datetime.now()
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Cannot sort by: {sort}")
+        where, params = self.query_conditions(filters or {})
+        limit = max(0, min(int(limit), QUERY_MAX_LIMIT))
+        offset = max(0, int(offset))
+        direction = "DESC" if descending else "ASC"
+        order = f"{sort} {direction}" if sort == "task_id" \
+                else f"{sort} {direction}, task_id {direction}"
         try:
-            query = """
-                    UPDATE tasks SET timestamp_start = ?, status = ?, 
-                    timestamp_expected_complete = ? 
-                    WHERE task_id = ?
-                    """
-            self.db_manager.execute_query(query, (
-                        now,
-                        "In progress",
-                        now + timedelta(seconds=time_left),
-                        task_id)
-                    )
+            total = self.db_manager.execute_query(
+                    f"SELECT COUNT(*) FROM tasks {where}",
+                    params
+            )[0][0]
+            rows = self.db_manager.execute_query(
+                    f"SELECT * FROM tasks {where} ORDER BY {order} LIMIT ? OFFSET ?",
+                    params + (limit, offset)
+            )
         except Exception as e:
-            print(f"Error updating the task start parameters: {e}")
-            raise RuntimeError("Failed to update the task status")
-        
-    def update_task_continue_parameters(self, time_left, task_id):
+            print(f"Error querying the tasks: {e}")
+            raise RuntimeError("Failed to query the tasks")
+        return rows, total
+
+    @staticmethod
+    def query_conditions(filters):
         """
-        Updates a tasks timestamp_start, status and 
-        timestamp_expected_complete.
+        Turn the filters of a query into a WHERE clause and its params.
+        Every column that can be filtered has an index (SQLite picks one of
+        them per query); the task_id prefix is a range on the primary key
+        instead of a LIKE. Sorting by a column other than the filtered one
+        is done on the matching rows only.
+        """
+        conditions = []
+        params = []
+        for field in ("machine", "material", "status"):
+            value = filters.get(field)
+            if value in (None, "", []):
+                continue
+            if isinstance(value, (list, tuple)):
+                conditions.append(f"{field} IN ({', '.join('?' for _ in value)})")
+                params.extend(value)
+            else:
+                conditions.append(f"{field} = ?")
+                params.append(value)
+        for field in ("speed", "started_at"):
+            low, high = filters.get(field) or (None, None)
+            column = "timestamp_start" if field == "started_at" else field
+            if low is not None:
+                conditions.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{column} <= ?")
+                params.append(high)
+        prefix = filters.get("task_id")
+        if prefix:
+            conditions.append("task_id >= ? AND task_id < ?")
+            params.extend((prefix, prefix + "\uffff"))
+        unknown = set(filters) - {
+                "machine", "material", "status", "speed", "started_at", "task_id"}
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, tuple(params)
+
+    def update_tasks_time_left(self, times_left):
+        """
+        Updates the time left of many tasks in a single transaction.
+        Requires a list of (task_id, time_left).
         """
-        now = datetime.now()
-        try:
-            query = """
-                    UPDATE tasks SET status = ?, 
-                    timestamp_expected_complete = ? WHERE task_id = ?
-                    """
-            self.db_manager.execute_query(query, (
-                        "In progress",
-                        now + timedelta(seconds=time_left),
-                        task_id
-                        )
-                    )
-        except Exception as e:
-            print(f"Error updating the task continue parameters: {e}")
-            raise RuntimeError("Failed to update the task status")
-        
-    def update_task_time_left(self, task_id, time_left):
-        """Updates a tasks timestamp_start and status."""
         try:
             query = "UPDATE tasks SET time_left = ? WHERE task_id = ?"
-            self.db_manager.execute_query(query, (time_left, task_id))
+            self.db_manager.execute_many(
+                    query,
+                    [(time_left, task_id) for task_id, time_left in times_left]
+            )
         except Exception as e:
-            print(f"Error updating the task time left: {e}")
-            raise RuntimeError("Failed to update the task status")
+            print(f"Error updating the tasks time left: {e}")
+            raise RuntimeError("Failed to update the tasks time left")
 
-    def udpate_task_complete(self, task_id):
-        """Updates a tasks status to "Completed" """
+    def save_task_changes(self, task_id, changes):
+        """
+        Saves a dict of {field: value} on the row of a task.
+        Used to persist changes that were already applied in memory.
+        """
+        fields = [field for field in changes if field in TASK_FIELDS]
+        if not fields:
+            return
         try:
-            query = """
-                    UPDATE tasks SET status = 'Completed', time_left = '', 
-                    timestamp_expected_complete = ? WHERE task_id = ?
-                    """
-            self.db_manager.execute_query(query, (datetime.now(), task_id))
+            query = (
+                    "UPDATE tasks SET "
+                    + ", ".join(f"{field} = ?" for field in fields)
+                    + " WHERE task_id = ?"
+            )
+            params = tuple(changes[field] for field in fields) + (task_id,)
+            self.db_manager.execute_query(query, params)
         except Exception as e:
-            print(f"Error updating the task time left: {e}")
-            raise RuntimeError("Failed to update the task status")
+            print(f"Error saving the task changes: {e}")
+            raise RuntimeError("Failed to save the task changes")
+
+
+    # Changes of each operation, calculated without touching the DB
+    @staticmethod
+    def update_changes(params_dict):
+        """Fields that change when a task is modified (speed recalculates time)."""
+        old_speed = int(params_dict["old_speed"])
+        new_speed = int(params_dict["new_speed"])
+        old_time_left = int(params_dict["time_left"])
+        new_time_left = int(old_time_left * old_speed / new_speed)
+        return {
+                "machine": params_dict["machine"],
+                "material": params_dict["material"],
+                "speed": new_speed,
+                "time_left": new_time_left,
+                "timestamp_expected_complete": Utils.now_ms() + new_time_left * 1000,
+        }
+
+    @staticmethod
+    def start_changes(time_left):
+        """Fields that change when a task starts for the first time."""
+        now = Utils.now_ms()
+        return {
+                "timestamp_start": now,
+                "status": "In progress",
+                "timestamp_expected_complete": now + time_left * 1000,
+        }
+
+    @staticmethod
+    def continue_changes(time_left):
+        """Fields that change when a started task is resumed."""
+        return {
+                "status": "In progress",
+                "timestamp_expected_complete": Utils.now_ms() + time_left * 1000,
+        }
+
+    @staticmethod
+    def complete_changes():
+        """Fields that change when a task is completed."""
+        return {
+                "status": "Completed",
+                "time_left": None,
+                "timestamp_expected_complete": Utils.now_ms(),
+        }
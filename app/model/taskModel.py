@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from utils.utils import Utils
+
 
 class TaskModel:
     def __init__(self, task_id=None, timestamp_start=None,
@@ -7,29 +9,53 @@ class TaskModel:
                 status="On queue", time_left=None,
                 timestamp_expected_complete=None, surface=None):
         self.task_id = task_id or datetime.now().strftime("%Y%m%d-%H%M%S")
-        self.timestamp_start = timestamp_start or ""
+        # Timestamps are epoch milliseconds (None if not set)
+        self.timestamp_start = timestamp_start or None
         self.machine = machine
         self.material = material
         self.speed = speed
         # String status
         self.status = status
         # Time that's left (int - seconds)
+        # For a started task this is only the last checkpoint (pause or
+        # shutdown), the real value is "remaining_time"
         self.time_left = time_left
-        # Time ex
-        self.timestamp_expected_complete = timestamp_expected_complete
+        # Time expected for the task to be completed
+        self.timestamp_expected_complete = timestamp_expected_complete or None
         self.surface = surface
 
 
+    @property
+    def remaining_time(self):
+        """
+        Seconds left to complete the task.
+        Derived from the expected completion and the clock while it runs.
+        """
+        if self.status == "In progress" and self.timestamp_expected_complete:
+            return max(0, int((self.timestamp_expected_complete - Utils.now_ms()) / 1000))
+        return self.time_left
+
+    @classmethod
+    def from_row(cls, row):
+        """Build a task from a row of the tasks table."""
+        return cls(*row)
+
     def to_tuple(self):
         """Turn the task into a tuple."""
         return (
             self.task_id,
-            str(self.timestamp_start),
+            self.timestamp_start,
             self.machine,
             self.material,
             self.speed,
             self.status,
             self.time_left,
-            str(self.timestamp_expected_complete),
+            self.timestamp_expected_complete,
             self.surface
-        )
\ No newline at end of file
+        )
+
+    def to_row(self):
+        """Turn the task into a tuple for the clients, with the time left derived."""
+        row = list(self.to_tuple())
+        row[6] = self.remaining_time
+        return tuple(row)
\ No newline at end of file
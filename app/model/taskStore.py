@@ -0,0 +1,123 @@
+from model.taskModel import TaskModel
+
+
+class TaskStore:
+    """
+    In-memory copy of the tasks table, loaded once when the server starts.
+    Tasks are indexed by task_id, machine and status so the server does not
+    need to read the whole table to take a decision. SQLite only persists.
+    """
+    def __init__(self):
+        # task_id -> TaskModel
+        self.tasks = {}
+        # machine -> {task_id: None} and status -> {task_id: None}
+        # Dicts are used as ordered sets to keep the creation order
+        self.by_machine = {}
+        self.by_status = {}
+        # task_id -> "task_added" | "task_changed" | "task_removed"
+        # Changes that have not been sent to the clients yet
+        self.changes = {}
+
+
+    def load(self, rows):
+        """Fill the store with the rows read from the DB."""
+        self.tasks.clear()
+        self.by_machine.clear()
+        self.by_status.clear()
+        for row in rows:
+            self.add(TaskModel.from_row(row))
+        # Loading is not a change, clients get it with the full state
+        self.changes.clear()
+
+    # Basic CRUD functions
+    def add(self, task):
+        """Add a task and index it."""
+        self.tasks[task.task_id] = task
+        self._index(task)
+        self._mark(task.task_id, "task_added")
+
+    def get(self, task_id):
+        """Returns the task with that task_id (or None)."""
+        return self.tasks.get(task_id)
+
+    def update(self, task_id, changes):
+        """
+        Apply a dict of {field: value} to a task.
+        The indexes are only touched if the machine or the status change.
+        """
+        task = self.tasks[task_id]
+        if "machine" in changes and changes["machine"] != task.machine:
+            self.by_machine[task.machine].pop(task_id, None)
+            self.by_machine.setdefault(changes["machine"], {})[task_id] = None
+        if "status" in changes and changes["status"] != task.status:
+            self.by_status[task.status].pop(task_id, None)
+            self.by_status.setdefault(changes["status"], {})[task_id] = None
+        for field, value in changes.items():
+            setattr(task, field, value)
+        self._mark(task_id, "task_changed")
+        return task
+
+    def remove(self, task_id):
+        """Remove a task and its index entries."""
+        task = self.tasks.pop(task_id, None)
+        if task:
+            self._unindex(task)
+            self._mark(task_id, "task_removed")
+        return task
+
+
+    # Queries over the indexes
+    def machines(self):
+        """Returns every machine that has ever had a task."""
+        return list(self.by_machine)
+
+    def tasks_by_status(self, status):
+        """Returns the tasks with that status, in creation order."""
+        return [self.tasks[task_id] for task_id in self.by_status.get(status, {})]
+
+    def rows(self):
+        """Returns all the tasks as rows, in the order of the DB columns."""
+        return [task.to_row() for task in self.tasks.values()]
+
+
+    # Changes for the clients
+    def drain_changes(self, keep=()):
+        """
+        Returns the pending changes as (kind, task_id) and forgets them.
+        Several changes on the same task are merged into one.
+        The changes of the task_ids in "keep" stay pending.
+        """
+        changes = [(kind, task_id) for task_id, kind in self.changes.items()
+                if task_id not in keep]
+        for _, task_id in changes:
+            del self.changes[task_id]
+        return changes
+
+    def mark_removed(self, task_id):
+        """Send a removal even if the clients are not known to have the task."""
+        if task_id not in self.tasks:
+            self.changes[task_id] = "task_removed"
+
+    def _mark(self, task_id, kind):
+        """Record a change, merging it with the one already pending."""
+        previous = self.changes.get(task_id)
+        if previous == "task_added" and kind == "task_removed":
+            # The clients never saw it
+            del self.changes[task_id]
+            return
+        if previous == "task_added":
+            # Still new for the clients
+            return
+        if previous == "task_removed" and kind == "task_added":
+            kind = "task_changed"
+        self.changes[task_id] = kind
+
+
+    def _index(self, task):
+        self.by_machine.setdefault(task.machine, {})[task.task_id] = None
+        self.by_status.setdefault(task.status, {})[task.task_id] = None
+
+    def _unindex(self, task):
+        # The machine key is kept so the machine is still known when empty
+        self.by_machine.get(task.machine, {}).pop(task.task_id, None)
+        self.by_status.get(task.status, {}).pop(task.task_id, None)
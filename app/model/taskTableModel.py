@@ -0,0 +1,305 @@
+from bisect import bisect_left, insort
+import itertools
+
+from model.taskFilter import TaskFilter
+
+# Index of the "Status" column on a row
+STATUS_COLUMN = 5
+# Index of the expected completion (epoch ms) on a row
+EXPECTED_COMPLETE_COLUMN = 7
+
+
+def value_sort_key(value):
+    """Empty values go first, then the values themselves."""
+    if value in ("", None):
+        return (0, 0)
+    return (1, value)
+
+def status_sort_key(value):
+    """
+    Custom sort: 'On queue' > 'In progress' > 'Completed'.
+    It will sort by the first value on the tuple and after that, by the second one.
+    """
+    if value == "On queue":
+        return (2, 0)
+    if value == "In progress":
+        return (1, 0)
+    if value == "Completed":
+        return (0, 0)
+    return (-1, 0)
+
+
+class TaskTableModel:
+    """
+    Client-side copy of every task of the main table.
+    The whole history lives here; the view only puts on the Treeview
+    the rows of the window that is visible.
+    The rows are kept sorted by the active column: every row has its sort key
+    cached and changes are put in place with bisect, so the sort survives
+    the updates from the server without sorting everything again.
+    When filters are active only the rows that pass them are shown,
+    kept in the same order.
+    """
+    def __init__(self):
+        # task_id -> row, as sent by the server
+        self.rows = {}
+        # Column sorted by (None: order of arrival) and direction
+        self.sort_column = None
+        self.sort_reverse = False
+        # (sort key, task_id) of every row, always ascending
+        self._entries = []
+        # task_id -> its entry on _entries (cached sort key)
+        self._keys = {}
+        # task_id -> order of arrival, to sort when no column is chosen
+        self._arrival = {}
+        self._arrival_counter = itertools.count()
+        # task_id -> expected completion (epoch ms) of the running tasks
+        # Only these rows need the countdown, whatever the size of the history
+        self.running = {}
+        # Indexes for the filters, and the entries that pass them
+        # (None when there is no filter: every entry is shown)
+        self.filter = TaskFilter()
+        self._shown = None
+        # task_id -> {"local", "confirmed", "updated"} of the changes made
+        # on this client that the server has not answered yet
+        self.pending = {}
+        # task_id given by the server -> temporary task_id of a created task
+        # whose row has not arrived yet
+        self._created = {}
+
+
+    def __len__(self):
+        return len(self._shown_entries)
+
+    @property
+    def _shown_entries(self):
+        return self._entries if self._shown is None else self._shown
+
+    @property
+    def order(self):
+        """task_ids in the order they are shown."""
+        task_ids = [task_id for _, task_id in self._shown_entries]
+        if self.sort_reverse:
+            task_ids.reverse()
+        return task_ids
+
+    # Sorting
+    def sort_by(self, column, reverse=False):
+        """Sort every row by a column index (None: order of arrival)."""
+        self.sort_column = column
+        self.sort_reverse = reverse
+        self._rebuild_entries()
+        self._apply_filter()
+
+    # Filtering
+    def set_filters(self, **filters):
+        """Show only the rows that pass every filter (see TaskFilter.set_filters)."""
+        self.filter.set_filters(**filters)
+        self._apply_filter()
+
+    def _apply_filter(self):
+        task_ids = self.filter.matching_ids()
+        if task_ids is None:
+            self._shown = None
+        else:
+            # Already sorted: keep the entries of the matching rows
+            self._shown = [entry for entry in self._entries if entry[1] in task_ids]
+
+    def _sort_key(self, task):
+        if self.sort_column is None:
+            return (self._arrival[task[0]],)
+        if self.sort_column == STATUS_COLUMN:
+            return status_sort_key(task[STATUS_COLUMN])
+        return value_sort_key(task[self.sort_column])
+
+    def _rebuild_entries(self):
+        self._keys = {
+            task_id: (self._sort_key(task), task_id)
+            for task_id, task in self.rows.items()
+        }
+        self._entries = sorted(self._keys.values())
+
+    def _put(self, task):
+        """Insert or move the entry of a task, only if its key changed."""
+        entry = (self._sort_key(task), task[0])
+        current = self._keys.get(task[0])
+        if current != entry:
+            if current is not None:
+                del self._entries[bisect_left(self._entries, current)]
+            insort(self._entries, entry)
+            self._keys[task[0]] = entry
+        if self._shown is not None:
+            # The row may enter or leave the filter even if its key is the same
+            self._remove_shown(current)
+            if self.filter.matches(task):
+                insort(self._shown, entry)
+
+    def _drop(self, task_id):
+        entry = self._keys.pop(task_id)
+        del self._entries[bisect_left(self._entries, entry)]
+        self._remove_shown(entry)
+
+    def _remove_shown(self, entry):
+        if self._shown is None or entry is None:
+            return
+        index = bisect_left(self._shown, entry)
+        if index < len(self._shown) and self._shown[index] == entry:
+            del self._shown[index]
+
+    # Changes from the server
+    def apply_message(self, message):
+        """Apply a "state" (full snapshot) or "deltas" message."""
+        if message["type"] == "state":
+            self.load(message["tasks"])
+        elif message["type"] == "deltas":
+            self.apply_changes(message["changes"])
+
+    def load(self, tasks):
+        """
+        Replace every row with the ones of a snapshot.
+        Local changes still waiting for the server are kept on top.
+        """
+        self.rows = {task[0]: task for task in tasks}
+        # Created tasks that are on the snapshot replace their temporary row
+        for task_id, temp_id in list(self._created.items()):
+            if task_id in self.rows:
+                del self._created[task_id]
+                self.pending.pop(temp_id, None)
+        for task_id, entry in self.pending.items():
+            entry["confirmed"] = self.rows.get(task_id)
+            entry["updated"] = True
+            if entry["local"] is None:
+                self.rows.pop(task_id, None)
+            else:
+                self.rows[task_id] = entry["local"]
+        tasks = list(self.rows.values())
+        # Tasks already seen keep their place of arrival
+        self._arrival = {
+            task_id: self._arrival.get(task_id, next(self._arrival_counter))
+            for task_id in self.rows
+        }
+        self.running = {}
+        for task in tasks:
+            self._track_running(task)
+        self.filter.load(tasks)
+        self._rebuild_entries()
+        self._apply_filter()
+
+    def apply_changes(self, changes):
+        """Apply a list of "task_added", "task_changed" and "task_removed"."""
+        for change in changes:
+            if change["type"] == "task_removed":
+                task_id, task = change["task_id"], None
+            else:
+                task_id, task = change["task"][0], change["task"]
+            if task_id in self._created:
+                self._replace_created(task_id)
+            if task_id in self.pending:
+                # The local change stays on screen until the server answers
+                self.pending[task_id]["confirmed"] = task
+                self.pending[task_id]["updated"] = True
+            elif task is None:
+                self._remove(task_id)
+            else:
+                self._upsert(task)
+
+    def _upsert(self, task):
+        if task[0] not in self._arrival:
+            self._arrival[task[0]] = next(self._arrival_counter)
+        self.filter.update(self.rows.get(task[0]), task)
+        self.rows[task[0]] = task
+        self._put(task)
+        self._track_running(task)
+
+    def _remove(self, task_id):
+        old_task = self.rows.pop(task_id, None)
+        if old_task is not None:
+            self.filter.remove(old_task)
+            self._drop(task_id)
+            del self._arrival[task_id]
+            self.running.pop(task_id, None)
+
+    # Optimistic changes, shown before the server confirms them
+    def apply_local(self, task_id, task):
+        """
+        Show a change made on this client right away (None removes the row).
+        The server's row is kept to go back to it if the change is rejected.
+        """
+        if task_id not in self.pending:
+            self.pending[task_id] = {
+                "confirmed": self.rows.get(task_id),
+                # True once the server sent the row after the local change
+                "updated": False,
+            }
+        self.pending[task_id]["local"] = task
+        if task is None:
+            self._remove(task_id)
+        else:
+            self._upsert(task)
+
+    def confirm_local(self, task_id):
+        """
+        The server accepted the change. If it already sent the row, that one
+        is shown; if not, the local one stays until its delta arrives.
+        """
+        entry = self.pending.pop(task_id, None)
+        if entry is not None and entry["updated"]:
+            self._show_confirmed(task_id, entry["confirmed"])
+
+    def revert_local(self, task_id):
+        """The server rejected the change: show its row again."""
+        entry = self.pending.pop(task_id, None)
+        if entry is not None:
+            self._show_confirmed(task_id, entry["confirmed"])
+
+    def confirm_created(self, temp_id, task_id):
+        """
+        The server created the task shown as "temp_id" with this task_id.
+        The temporary row stays until the server's row replaces it.
+        """
+        if temp_id not in self.pending:
+            return
+        self._created[task_id] = temp_id
+        if task_id in self.rows:
+            # Its row arrived before the ack
+            self._replace_created(task_id)
+
+    def _replace_created(self, task_id):
+        """Drop the temporary row of a created task, keeping its place."""
+        temp_id = self._created.pop(task_id)
+        self.pending.pop(temp_id, None)
+        arrival = self._arrival.get(temp_id)
+        self._remove(temp_id)
+        if arrival is not None and task_id not in self._arrival:
+            self._arrival[task_id] = arrival
+
+    def _show_confirmed(self, task_id, task):
+        if task is None:
+            self._remove(task_id)
+        else:
+            self._upsert(task)
+
+    def _track_running(self, task):
+        """Keep the running tasks (with a known completion) on the index."""
+        expected = task[EXPECTED_COMPLETE_COLUMN]
+        if task[STATUS_COLUMN] == "In progress" and expected is not None:
+            self.running[task[0]] = int(expected)
+        else:
+            self.running.pop(task[0], None)
+
+
+    # Reading the rows
+    def window(self, start, count):
+        """Returns the rows shown from "start" (included), at most "count"."""
+        shown = self._shown_entries
+        if self.sort_reverse:
+            # Shown position i is entry len - 1 - i
+            end = len(shown) - start
+            entries = reversed(shown[max(0, end - count):max(0, end)])
+        else:
+            entries = shown[start:start + count]
+        return [self.rows[task_id] for _, task_id in entries]
+
+    def get(self, task_id):
+        """Returns the row of a task (or None)."""
+        return self.rows.get(task_id)
@@ -0,0 +1,24 @@
+import argparse
+
+from utils.utils import Utils
+from utils.wss import WebSocketServer
+
+if __name__ == "__main__":
+    # Run from the project folder: python app/server.py
+    # Host, port and DB path come from config.json unless given here
+    server_config = Utils.load_server_config()
+    parser = argparse.ArgumentParser(description="Task generator WebSocket server")
+    parser.add_argument("--host", default=server_config["host"])
+    parser.add_argument("--port", type=int, default=server_config["port"])
+    parser.add_argument("--db", dest="db_path", default=server_config["db_path"])
+    args = parser.parse_args()
+
+    server = WebSocketServer(args.db_path, host=args.host, port=args.port)
+    # Ctrl+C or SIGTERM: save the running tasks and close before exiting
+    try:
+        server.run(handle_signals=True)
+    except OSError as e:
+        # Usually another server is already on that port
+        print(f"Could not start the server on ws://{args.host}:{args.port}: {e}")
+        raise SystemExit(1)
+    print("WebSocket server stopped")
@@ -0,0 +1,122 @@
+import asyncio
+from collections import deque
+import time
+
+from utils.encoding import JSON
+
+# Marker on the queue: send the newest snapshot here
+RESYNC = object()
+
+
+class ClientConnection:
+    """
+    Outbound side of a client: a bounded queue and a writer task of its own,
+    so a slow client never delays what the others receive.
+    - State messages (snapshots and deltas) of a client that falls behind
+      ("max_pending" messages waiting) collapse into a single snapshot,
+      built when the writer gets to it (the newest state).
+    - A client that is still behind after "max_lag" seconds is disconnected.
+    Other messages (answers to queries) are never dropped: while they alone
+    fill the queue the client is behind too, with the same "max_lag" to
+    catch up.
+    """
+    def __init__(self, websocket, snapshot_message, max_pending=64, max_lag=10.0):
+        self.websocket = websocket
+        # Function that returns the snapshot message for this client
+        self.snapshot_message = snapshot_message
+        self.max_pending = max_pending
+        self.max_lag = max_lag
+        # How state messages are serialized for this client (see utils.encoding)
+        self.encoding = JSON
+        # (message or RESYNC, is_state)
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+        # A snapshot is on the queue: newer state messages are not needed
+        self._resync = False
+        # When the client fell behind (None if it is not)
+        self._behind_since = None
+        self.closed = False
+        self.stats = {
+            "sent": 0,
+            "dropped": 0,
+            "resyncs": 0,
+            "max_depth": 0,
+            "evicted": False,
+        }
+        self._writer = asyncio.create_task(self._write())
+
+
+    @property
+    def depth(self):
+        """Messages waiting to be sent."""
+        return len(self._pending)
+
+    def put(self, message, state=False):
+        """Queue a message. State messages can be collapsed into a snapshot."""
+        if self.closed:
+            return
+        if (self._behind_since is not None
+                and time.monotonic() - self._behind_since > self.max_lag):
+            self.evict()
+            return
+        if state and self._resync:
+            # The snapshot that is on the queue will be newer than this
+            self.stats["dropped"] += 1
+            return
+        self._pending.append((message, state))
+        # With a snapshot on the queue only answers are left to collapse
+        if len(self._pending) > self.max_pending and not self._resync:
+            self._fall_behind()
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._pending))
+        self._wakeup.set()
+
+    def close(self):
+        """Stop the writer. Whatever is on the queue is not sent."""
+        self.closed = True
+        self._writer.cancel()
+
+    def evict(self):
+        """Disconnect a client that cannot keep up."""
+        if self.closed:
+            return
+        print(f"Disconnecting slow client ({self.depth} messages waiting)")
+        self.stats["evicted"] = True
+        self.close()
+        asyncio.create_task(self.websocket.close(code=1013, reason="Too slow"))
+
+
+    def _fall_behind(self):
+        """Collapse the state messages on the queue into one snapshot."""
+        if self._behind_since is None:
+            self._behind_since = time.monotonic()
+        kept = deque(item for item in self._pending if not item[1])
+        if len(kept) == len(self._pending):
+            # Only answers: nothing to collapse, the client has "max_lag"
+            return
+        self.stats["dropped"] += len(self._pending) - len(kept)
+        kept.append((RESYNC, True))
+        self._pending = kept
+        self._resync = True
+        self.stats["resyncs"] += 1
+
+    async def _write(self):
+        try:
+            while True:
+                if not self._pending:
+                    # Caught up
+                    self._behind_since = None
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                message, _ = self._pending.popleft()
+                if message is RESYNC:
+                    self._resync = False
+                    message = self.snapshot_message()
+                await self.websocket.send(message)
+                self.stats["sent"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The connection is gone, the handler cleans up
+            print(f"WebSocket send error: {e}")
+            self.closed = True
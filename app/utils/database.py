@@ -1,43 +1,356 @@
+import asyncio
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+import queue
 import sqlite3
+import threading
+
+# Version of the schema, stored on the DB file as "PRAGMA user_version"
+SCHEMA_VERSION = 3
+
+# Timestamps are epoch milliseconds, task_id is the real primary key
+TASKS_TABLE = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            timestamp_start INTEGER,
+            machine TEXT,
+            material TEXT,
+            speed INTEGER,
+            status TEXT,
+            time_left INTEGER,
+            timestamp_expected_complete INTEGER,
+            surface INTEGER
+        )
+    """
+# Indexes added by every schema version
+TASKS_INDEXES = {
+    1: (
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status_machine ON tasks (status, machine)",
+    ),
+    # Filters and sorting of the "query" action
+    2: (
+        "CREATE INDEX IF NOT EXISTS idx_tasks_machine ON tasks (machine)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_timestamp_start ON tasks (timestamp_start)",
+    ),
+    3: (
+        "CREATE INDEX IF NOT EXISTS idx_tasks_material ON tasks (material)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_speed ON tasks (speed)",
+    ),
+}
 
 
 class DatabaseManager:
-    def __init__(self, db_path="tasks.db"):
+    """
+    Keeps long-lived connections to the DB instead of opening one per query.
+    - One writer connection (SQLite allows a single writer at a time).
+    - A small pool of reader connections, which WAL lets run alongside the writer.
+    Writes commit one by one unless they are made inside "transaction()",
+    which groups them into a single commit (a single fsync).
+    """
+    def __init__(self, db_path="tasks.db", read_pool_size=4,
+                busy_timeout=5000, synchronous="NORMAL"):
         self.db_path = db_path
+        # Milliseconds a connection waits on a locked DB before failing
+        self.busy_timeout = busy_timeout
+        # NORMAL is safe with WAL and skips an fsync per commit
+        self.synchronous = synchronous
+
+        self._writer = self._open_connection()
+        # Reentrant, so queries can be run inside a transaction
+        self._writer_lock = threading.RLock()
+        # Nested transaction() calls and the thread that holds them
+        self._transaction_depth = 0
+        self._transaction_thread = None
+        # The journal mode is stored in the file, so it is set only once
+        self._writer.execute("PRAGMA journal_mode=WAL")
+
+        self._readers = queue.Queue()
+        for _ in range(read_pool_size):
+            self._readers.put(self._open_connection())
+
         self.initialize_database()
 
 
     def initialize_database(self):
-        """Create the file for the database. Initializes it if needed."""
+        """
+        Create the file for the database. Initializes it if needed.
+        Older files are migrated in place to the current schema version.
+        """
         try:
-            query = """
-                    CREATE TABLE IF NOT EXISTS tasks (
-                        task_id TEXT PRIMARY_KEY,
-                        timestamp_start DATETIME,
-                        machine TEXT,
-                        material TEXT,
-                        speed INTEGER,
-                        status TEXT,
-                        time_left INTEGER,
-                        timestamp_expected_complete DATETIME,
-                        surface INTEGER
-                    )
-                """
-            
-            self.execute_query(query)
+            with self._writer_lock:
+                version = self._writer.execute("PRAGMA user_version").fetchone()[0]
+                if version >= SCHEMA_VERSION:
+                    return
+                self._writer.execute("BEGIN")
+                try:
+                    if version < 1:
+                        self._migrate_to_v1()
+                    if version < 2:
+                        self._migrate_to_v2()
+                    if version < 3:
+                        self._migrate_to_v3()
+                    self._writer.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    self._writer.commit()
+                except Exception:
+                    self._writer.rollback()
+                    raise
         except Exception as e:
             print(f"Error initializing schema: {e}")
             raise RuntimeError("Failed to initialize DB schema")
-    
-    
+
+    def _migrate_to_v1(self):
+        """
+        Version 0 had no primary key ("PRIMARY_KEY" typo), no indexes
+        and timestamps saved as text. The table is rebuilt with:
+        - task_id as primary key (repeated ids get a "-n" suffix).
+        - An index on (status, machine).
+        - Timestamps as epoch milliseconds and no '' on time_left.
+        """
+        old_table = self._writer.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'tasks'"
+        ).fetchone()
+        if old_table:
+            self._writer.execute("ALTER TABLE tasks RENAME TO tasks_v0")
+        self._writer.execute(TASKS_TABLE)
+        self._create_indexes(1)
+        if not old_table:
+            return
+
+        rows = []
+        seen_ids = set()
+        for row in self._writer.execute("SELECT * FROM tasks_v0 ORDER BY rowid"):
+            task_id = row[0]
+            suffix = 1
+            while task_id in seen_ids:
+                suffix += 1
+                task_id = f"{row[0]}-{suffix}"
+            seen_ids.add(task_id)
+            rows.append((
+                    task_id,
+                    self._text_to_epoch_ms(row[1]),
+                    row[2],
+                    row[3],
+                    row[4],
+                    row[5],
+                    row[6] if row[6] != "" else None,
+                    self._text_to_epoch_ms(row[7]),
+                    row[8],
+            ))
+        self._writer.executemany(
+                "INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+        )
+        self._writer.execute("DROP TABLE tasks_v0")
+
+    def _migrate_to_v2(self):
+        """Version 2 adds the indexes on machine and timestamp_start."""
+        self._create_indexes(2)
+
+    def _migrate_to_v3(self):
+        """Version 3 adds the indexes on material and speed."""
+        self._create_indexes(3)
+
+    def _create_indexes(self, version):
+        """Create the indexes that a schema version adds."""
+        for index in TASKS_INDEXES[version]:
+            self._writer.execute(index)
+
+    @staticmethod
+    def _text_to_epoch_ms(value):
+        """Turn a str(datetime) of the old schema into epoch milliseconds."""
+        if value in (None, "", "None"):
+            return None
+        if isinstance(value, datetime):
+            return int(value.timestamp() * 1000)
+        for date_format in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+            try:
+                return int(datetime.strptime(value, date_format).timestamp() * 1000)
+            except ValueError:
+                continue
+        return None
+
+
+    def _open_connection(self):
+        """Open a connection that can be shared between threads."""
+        connection = sqlite3.connect(
+                self.db_path,
+                # Access is serialized by the lock and the pool
+                check_same_thread=False
+        )
+        connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+        return connection
+
+    @staticmethod
+    def _is_read_query(query):
+        """SELECT queries can be sent to the read pool."""
+        return query.lstrip().upper().startswith("SELECT")
+
+    def _in_transaction(self):
+        """True if this thread has a transaction open."""
+        return (self._transaction_depth > 0
+                and self._transaction_thread == threading.get_ident())
+
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work: every write inside the block is committed once at the end,
+        or rolled back if anything fails. Transactions can be nested: an inner
+        one is a SAVEPOINT, so its failure only undoes its own writes.
+        """
+        with self._writer_lock:
+            self._transaction_depth += 1
+            self._transaction_thread = threading.get_ident()
+            depth = self._transaction_depth
+            savepoint = f"transaction_{depth}"
+            try:
+                if depth == 1:
+                    # Explicit, so a savepoint never starts (and commits) its own
+                    self._writer.execute("BEGIN")
+                else:
+                    self._writer.execute(f"SAVEPOINT {savepoint}")
+                yield self
+                if depth == 1:
+                    self._writer.commit()
+                else:
+                    self._writer.execute(f"RELEASE {savepoint}")
+            except Exception:
+                if depth == 1:
+                    self._writer.rollback()
+                elif self._writer.in_transaction:
+                    self._writer.execute(f"ROLLBACK TO {savepoint}")
+                    self._writer.execute(f"RELEASE {savepoint}")
+                raise
+            finally:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._transaction_thread = None
+
     def execute_query(self, query, params=()):
         """Execute a query with n amount of params."""
-        with sqlite3.connect(
-                self.db_path,
-                detect_types= sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
-        ) as connection:
-            cursor = connection.cursor()
-            cursor.execute(query, params)
-            connection.commit()
+        # Reads inside a transaction have to see its uncommitted writes
+        if self._is_read_query(query) and not self._in_transaction():
+            connection = self._readers.get()
+            try:
+                # Returns a list
+                return connection.execute(query, params).fetchall()
+            finally:
+                self._readers.put(connection)
+
+        with self.transaction():
             # Returns a list
-            return cursor.fetchall()
\ No newline at end of file
+            return self._writer.execute(query, params).fetchall()
+
+    def execute_many(self, query, params_list):
+        """Execute the same query for every tuple of params, in one commit."""
+        with self.transaction():
+            self._writer.executemany(query, params_list)
+
+    def close(self):
+        """Close every connection of the pool."""
+        with self._writer_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get().close()
+
+
+class AsyncStorage:
+    """
+    Runs the DB operations on a dedicated thread so the server's event loop
+    never waits on a commit.
+    Operations are queued in order. Every operation already waiting when the
+    thread picks one up is run in the same transaction (one commit for all).
+    """
+    def __init__(self, db_manager, max_group=256):
+        self.db_manager = db_manager
+        # Maximum number of operations committed together
+        self.max_group = max_group
+        # (function, args, future), None stops the thread
+        self._operations = queue.Queue()
+        self.stats = {"operations": 0, "commits": 0, "largest_group": 0}
+        self._thread = threading.Thread(
+                target=self._run,
+                name="db-storage",
+                daemon=True
+        )
+        self._thread.start()
+
+
+    def submit(self, function, *args):
+        """Queue an operation. Returns a concurrent Future with its result."""
+        future = Future()
+        self._operations.put((function, args, future))
+        return future
+
+    async def run(self, function, *args):
+        """Queue an operation and wait (without blocking the loop) for its result."""
+        return await asyncio.wrap_future(self.submit(function, *args))
+
+    def defer(self, function, *args):
+        """Queue an operation nobody waits for. Errors are only printed."""
+        future = self.submit(function, *args)
+        future.add_done_callback(self._print_error)
+        return future
+
+    def close(self, timeout=None):
+        """Finish the queued operations and stop the thread."""
+        self._operations.put(None)
+        self._thread.join(timeout)
+
+
+    @staticmethod
+    def _print_error(future):
+        if future.exception() is not None:
+            print(f"Error saving to the DB: {future.exception()}")
+
+    def _run(self):
+        while True:
+            operation = self._operations.get()
+            if operation is None:
+                return
+            group = [operation]
+            stop = False
+            # Take everything that queued up while the last commit was running
+            while len(group) < self.max_group:
+                try:
+                    operation = self._operations.get_nowait()
+                except queue.Empty:
+                    break
+                if operation is None:
+                    stop = True
+                    break
+                group.append(operation)
+            self._run_group(group)
+            if stop:
+                return
+
+    def _run_group(self, group):
+        """Run a group of operations in a single transaction."""
+        results = []
+        try:
+            with self.db_manager.transaction():
+                for function, args, future in group:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        # Every operation is all or nothing, on its own
+                        with self.db_manager.transaction():
+                            results.append((future, function(*args), None))
+                    except Exception as e:
+                        # A failed operation does not undo the others
+                        results.append((future, None, e))
+        except Exception as e:
+            # The commit failed, nothing of the group was saved
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.stats["operations"] += len(results)
+        self.stats["commits"] += 1
+        self.stats["largest_group"] = max(self.stats["largest_group"], len(group))
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,80 @@
+import queue
+
+# Milliseconds between two drains of the queue (about 30 per second)
+FRAME_INTERVAL = 33
+
+
+class TkDispatcher:
+    """
+    Hands the messages of the WebSocket thread to the Tk thread.
+    The client thread only puts (already decoded) messages on a thread-safe
+    queue; the Tk loop drains it with "after()" once per frame, so widgets
+    are only touched from the Tk thread and a burst of messages costs one
+    update per frame:
+    - A "state" replaces everything received before it.
+    - Consecutive "deltas" are merged, keeping the last change of each task.
+    """
+    def __init__(self, root, on_messages, interval=FRAME_INTERVAL):
+        self.root = root
+        # Function called (on the Tk thread) with the list of merged messages
+        self.on_messages = on_messages
+        self.interval = interval
+        self._messages = queue.SimpleQueue()
+        self.stats = {"received": 0, "frames": 0, "applied": 0}
+        self.root.after(self.interval, self._drain)
+
+
+    def push(self, message):
+        """Queue a message. Safe to call from any thread."""
+        self._messages.put(message)
+
+    @staticmethod
+    def merge(messages):
+        """
+        Merge a list of messages (in arrival order) into the fewest to apply.
+        Returns [state?, deltas?] plus the other messages, in order.
+        """
+        merged = []
+        state = None
+        # task_id -> its last change, in order of the first one
+        changes = {}
+        deltas = None
+        for message in messages:
+            message_type = message.get("type")
+            if message_type == "state":
+                # Everything before is included in the snapshot
+                state = message
+                changes = {}
+                deltas = None
+            elif message_type == "deltas":
+                for change in message["changes"]:
+                    task_id = change.get("task_id") or change["task"][0]
+                    changes[task_id] = change
+                if deltas is None:
+                    deltas = dict(message)
+                deltas["version"] = message["version"]
+            else:
+                merged.append(message)
+        result = [state] if state is not None else []
+        if deltas is not None:
+            deltas["changes"] = list(changes.values())
+            result.append(deltas)
+        return result + merged
+
+    def _drain(self):
+        messages = []
+        while True:
+            try:
+                messages.append(self._messages.get_nowait())
+            except queue.Empty:
+                break
+        if messages:
+            merged = self.merge(messages)
+            self.stats["received"] += len(messages)
+            self.stats["frames"] += 1
+            self.stats["applied"] += len(merged)
+            try:
+                self.on_messages(merged)
+            except Exception as e:
+                print(f"Error updating the view: {e}")
+        self.root.after(self.interval, self._drain)
@@ -0,0 +1,119 @@
+import json
+import zlib
+
+# Encodings a client can ask for. Clients that ask for none get JSON text
+JSON = "json"
+COMPACT = "compact"
+COMPACT_ZLIB = "compact+zlib"
+ENCODINGS = (JSON, COMPACT, COMPACT_ZLIB)
+
+# Columns of a row, in order
+ROW_COLUMNS = (
+    "task_id",
+    "timestamp_start",
+    "machine",
+    "material",
+    "speed",
+    "status",
+    "time_left",
+    "timestamp_expected_complete",
+    "surface",
+)
+# Columns with few distinct values, sent as indexes of a string table
+INTERNED_COLUMNS = (2, 3, 5)
+
+# First byte of a compact frame
+FLAG_ZLIB = 0x01
+
+
+def encode(payload, encoding=JSON):
+    """
+    Serialize a state message ("state" or "deltas").
+    - JSON: the message as it is (str, sent as a text frame).
+    - COMPACT: columns instead of rows, machine, material and status
+      as indexes of a string table (bytes, sent as a binary frame).
+    - COMPACT_ZLIB: the same, compressed.
+    """
+    if encoding == JSON:
+        return json.dumps(payload)
+    body = json.dumps(to_columns(payload), separators=(",", ":")).encode()
+    if encoding == COMPACT_ZLIB:
+        return bytes((FLAG_ZLIB,)) + zlib.compress(body)
+    return b"\x00" + body
+
+def decode(message):
+    """Turn a frame (text or binary) back into the message as JSON has it."""
+    if isinstance(message, str):
+        return json.loads(message)
+    body = message[1:]
+    if message[0] & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    return from_columns(json.loads(body))
+
+
+def to_columns(payload):
+    """
+    Columnar layout of a state message.
+    "state": its rows. "deltas": the rows of the added/changed tasks in order,
+    the kind and version of every change and the task_ids of the removed ones.
+    """
+    columnar = {key: value for key, value in payload.items()
+            if key not in ("tasks", "changes")}
+    if payload["type"] == "state":
+        rows = payload["tasks"]
+    else:
+        rows = []
+        columnar["kinds"] = []
+        columnar["versions"] = []
+        columnar["removed"] = []
+        for change in payload["changes"]:
+            columnar["kinds"].append(change["type"])
+            columnar["versions"].append(change["version"])
+            if change["type"] == "task_removed":
+                columnar["removed"].append(change["task_id"])
+            else:
+                rows.append(change["task"])
+
+    if rows:
+        columns = [list(column) for column in zip(*rows)]
+    else:
+        columns = [[] for _ in ROW_COLUMNS]
+    # Every distinct value once, in order of appearance
+    strings = list(dict.fromkeys(
+            value
+            for index in INTERNED_COLUMNS
+            for value in columns[index]
+    ))
+    strings.extend(kind for kind in dict.fromkeys(columnar.get("kinds", ()))
+            if kind not in strings)
+    interned = {value: position for position, value in enumerate(strings)}
+    for index in INTERNED_COLUMNS:
+        columns[index] = [interned[value] for value in columns[index]]
+    if "kinds" in columnar:
+        columnar["kinds"] = [interned[kind] for kind in columnar["kinds"]]
+    columnar["strings"] = strings
+    columnar["columns"] = columns
+    return columnar
+
+def from_columns(columnar):
+    """Rebuild the rows (and changes) of a columnar state message."""
+    strings = columnar.pop("strings")
+    columns = columnar.pop("columns")
+    for index in INTERNED_COLUMNS:
+        columns[index] = [strings[value] for value in columns[index]]
+    rows = [list(row) for row in zip(*columns)]
+    if columnar["type"] == "state":
+        columnar["tasks"] = rows
+        return columnar
+
+    rows = iter(rows)
+    removed = iter(columnar.pop("removed"))
+    changes = []
+    for kind, version in zip(columnar.pop("kinds"), columnar.pop("versions")):
+        kind = strings[kind]
+        if kind == "task_removed":
+            changes.append({"type": kind, "version": version, "task_id": next(removed)})
+        else:
+            changes.append({"type": kind, "version": version, "task": next(rows)})
+    columnar["changes"] = changes
+    return columnar
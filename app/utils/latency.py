@@ -0,0 +1,50 @@
+from collections import deque
+import math
+
+# Samples kept per action (the histogram only covers the latest ones)
+LATENCY_WINDOW = 500
+
+
+class LatencyStats:
+    """
+    Rolling round-trip latencies (ms) per action: from "send" to the reply.
+    Only the last "window" samples of every action are kept, so the
+    percentiles follow what the station sees now.
+    """
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        # action -> deque of latencies (ms)
+        self.samples = {}
+
+
+    def record(self, action, latency_ms):
+        samples = self.samples.get(action)
+        if samples is None:
+            samples = self.samples[action] = deque(maxlen=self.window)
+        samples.append(latency_ms)
+
+    @staticmethod
+    def percentile(sorted_samples, percent):
+        """Nearest-rank percentile of an already sorted list."""
+        rank = max(1, math.ceil(percent / 100 * len(sorted_samples)))
+        return sorted_samples[rank - 1]
+
+    def summary(self, action=None):
+        """
+        {action: {"count", "p50", "p95", "p99", "max"}} for every action
+        (or only the one given).
+        """
+        actions = [action] if action is not None else list(self.samples)
+        summary = {}
+        for name in actions:
+            samples = sorted(self.samples.get(name, ()))
+            if not samples:
+                continue
+            summary[name] = {
+                "count": len(samples),
+                "p50": self.percentile(samples, 50),
+                "p95": self.percentile(samples, 95),
+                "p99": self.percentile(samples, 99),
+                "max": samples[-1],
+            }
+        return summary
@@ -0,0 +1,104 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class CompletionScheduler:
+    """
+    Single timer for the completion of every started task.
+    Deadlines (epoch seconds) are kept in a heap and only the earliest one
+    has an asyncio timer. Cancelled entries stay in the heap and are skipped
+    when they reach the top, so schedule, reschedule and cancel are O(log n).
+    """
+    def __init__(self, on_complete):
+        # Function called with the list of task_ids whose deadline arrived
+        self.on_complete = on_complete
+        # [deadline, order, task_id, is_valid]
+        self._heap = []
+        # task_id -> its valid entry on the heap
+        self._entries = {}
+        self._order = itertools.count()
+        # Timer for the first deadline and the deadline it was set for
+        self._timer = None
+        self._timer_deadline = None
+
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, task_id):
+        return task_id in self._entries
+
+    def schedule(self, task_id, deadline):
+        """Complete the task at the deadline, replacing any previous one."""
+        self._discard(task_id)
+        entry = [deadline, next(self._order), task_id, True]
+        self._entries[task_id] = entry
+        heapq.heappush(self._heap, entry)
+        self._arm()
+
+    def cancel(self, task_id):
+        """Forget the completion of a task (deleted, completed...)."""
+        if self._discard(task_id):
+            self._arm()
+
+    def clear(self):
+        """Cancel every pending completion."""
+        self._heap.clear()
+        self._entries.clear()
+        self._cancel_timer()
+
+
+    def _discard(self, task_id):
+        """Mark the entry of a task as invalid. Returns if there was one."""
+        entry = self._entries.pop(task_id, None)
+        if entry is None:
+            return False
+        entry[3] = False
+        # Rebuild the heap if most of it are cancelled entries
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [e for e in self._heap if e[3]]
+            heapq.heapify(self._heap)
+        return True
+
+    def _arm(self):
+        """Set the timer for the earliest valid deadline."""
+        while self._heap and not self._heap[0][3]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            self._cancel_timer()
+            return
+        deadline = self._heap[0][0]
+        if self._timer is not None and self._timer_deadline == deadline:
+            return
+        self._cancel_timer()
+        delay = max(0, deadline - time.time())
+        self._timer = asyncio.get_running_loop().call_later(delay, self._fire)
+        self._timer_deadline = deadline
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        self._timer_deadline = None
+
+    def _fire(self):
+        """Complete every task whose deadline has passed."""
+        self._timer = None
+        self._timer_deadline = None
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not entry[3]:
+                continue
+            del self._entries[entry[2]]
+            due.append(entry[2])
+        if due:
+            # All of them at once, so they can be saved together
+            try:
+                self.on_complete(due)
+            except Exception as e:
+                print(f"Error completing tasks {due}: {e}")
+        self._arm()
@@ -0,0 +1,81 @@
+class SubscriptionIndex:
+    """
+    What every client wants to receive: a set of machines, of statuses or both
+    (None means any). Clients with the same subscription form a group, and the
+    changes are routed to groups, so a message is serialized once per group.
+    Groups are indexed by machine, so routing a change only looks at the groups
+    that can be interested in it.
+    """
+    def __init__(self):
+        # (machines, statuses) -> set of clients
+        self.groups = {}
+        # client -> its (machines, statuses)
+        self.clients = {}
+        # machine -> keys of the groups subscribed to it
+        self._by_machine = {}
+        # Keys of the groups subscribed to every machine
+        self._any_machine = set()
+
+
+    def __len__(self):
+        return len(self.clients)
+
+    @staticmethod
+    def make_key(machines=None, statuses=None):
+        """Key of a subscription. Empty lists mean any value."""
+        return (
+            frozenset(machines) if machines else None,
+            frozenset(statuses) if statuses else None
+        )
+
+    @staticmethod
+    def matches(key, machine, status):
+        """True if a task (by its machine and status) belongs to a subscription."""
+        machines, statuses = key
+        return ((machines is None or machine in machines)
+                and (statuses is None or status in statuses))
+
+    def subscribe(self, client, machines=None, statuses=None):
+        """Set (or replace) the subscription of a client. Returns its key."""
+        self.unsubscribe(client)
+        key = self.make_key(machines, statuses)
+        if key not in self.groups:
+            self.groups[key] = set()
+            if key[0] is None:
+                self._any_machine.add(key)
+            else:
+                for machine in key[0]:
+                    self._by_machine.setdefault(machine, set()).add(key)
+        self.groups[key].add(client)
+        self.clients[client] = key
+        return key
+
+    def unsubscribe(self, client):
+        """Forget a client. The group goes away with its last client."""
+        key = self.clients.pop(client, None)
+        if key is None:
+            return
+        group = self.groups[key]
+        group.discard(client)
+        if group:
+            return
+        del self.groups[key]
+        if key[0] is None:
+            self._any_machine.discard(key)
+        else:
+            for machine in key[0]:
+                keys = self._by_machine[machine]
+                keys.discard(key)
+                if not keys:
+                    del self._by_machine[machine]
+
+    def key_of(self, client):
+        return self.clients.get(client)
+
+    def matching_groups(self, machine, status):
+        """Keys of the groups a task (by its machine and status) goes to."""
+        return {
+            key
+            for key in self._any_machine | self._by_machine.get(machine, set())
+            if key[1] is None or status in key[1]
+        }
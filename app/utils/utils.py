@@ -1,4 +1,6 @@
+from datetime import datetime, timedelta
 import json
+import time
 
 
 class Utils:
@@ -21,12 +23,80 @@ class Utils:
         window.geometry(f"{width}x{height}+{position_x}+{position_y}")
 
 
+    @staticmethod
+    def when_done(widget, future, callback, interval=50):
+        """
+        Call "callback(future)" on the Tk thread once a Future is done.
+        The Future completes on the client's thread, so it is polled with after().
+        """
+        if future.done():
+            callback(future)
+        else:
+            widget.after(interval, Utils.when_done, widget, future, callback, interval)
+
+    @staticmethod
+    def show_reply(widget, future, success_text, failure_prefix):
+        """
+        Show the server's answer to an operation once it arrives.
+        "success_text" can use the fields of the result, like {task_id}.
+        """
+        # Only the GUIs show messages, the server does not need tkinter
+        from tkinter import messagebox
+
+        def show(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                messagebox.showerror("Error", f"{failure_prefix}: {e}")
+                return
+            messagebox.showinfo("Success", success_text.format(**result))
+        Utils.when_done(widget, future, show)
+
+
+    @staticmethod
+    def now_ms():
+        """Current time as epoch milliseconds (how timestamps are stored)."""
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def format_timestamp(timestamp_ms):
+        """Turn epoch milliseconds into a readable date. Empty if there is none."""
+        if timestamp_ms in (None, ""):
+            return ""
+        return datetime.fromtimestamp(int(timestamp_ms) / 1000).strftime(
+                "%Y-%m-%d %H:%M:%S"
+        )
+
+    @staticmethod
+    def parse_timestamp(text, end_of_day=False):
+        """
+        Turn a date ("YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS") into epoch milliseconds.
+        With only the date, end_of_day gives its last millisecond instead of the first.
+        Raises ValueError if the text is not a date.
+        """
+        text = text.strip()
+        try:
+            date = datetime.strptime(text, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            date = datetime.strptime(text, "%Y-%m-%d")
+            if end_of_day:
+                date += timedelta(days=1) - timedelta(milliseconds=1)
+        return int(date.timestamp() * 1000)
+
+
     @staticmethod
     def load_config():
         """Load the configuration from the config.json file."""
         with open("app/utils/config.json", "r") as file:
             return json.load(file)
 
+    @staticmethod
+    def load_server_config():
+        """Host, port and DB path of the server ("server" on config.json)."""
+        server = {"host": "127.0.0.1", "port": 8765, "db_path": "tasks.db"}
+        server.update(Utils.load_config().get("server", {}))
+        return server
+
 
     def validate_inputs(self, machine, material, speed):
         """Validate that inputs are not empty and speed is a valid number."""
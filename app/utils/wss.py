@@ -1,76 +1,466 @@
 import asyncio
-from datetime import datetime
+from collections import deque
+from concurrent.futures import Future
+import itertools
 import websockets
 import json
+import random
+import signal
 import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlparse
+import uuid
 
 from websockets.protocol import OPEN
 
 from model.taskManager import TaskManager
 from model.taskModel import TaskModel
-from utils.database import DatabaseManager
+from model.taskStore import TaskStore
+from utils.connections import ClientConnection
+from utils.database import AsyncStorage, DatabaseManager
+from utils.encoding import COMPACT_ZLIB, ENCODINGS, JSON, decode, encode
+from utils.latency import LatencyStats
+from utils.scheduler import CompletionScheduler
+from utils.subscriptions import SubscriptionIndex
+from utils.utils import Utils
 
 WS_HOST = "127.0.0.1"
 WS_PORT = 8765
+# Changes remembered so a reconnecting client only gets what it missed
+HISTORY_SIZE = 10000
 
 class WebSocketServer:
     """
     WebSocket server for handling task operations and broadcasting state.
     Handles connections, receives operations from clients, updates DB,
     broadcasts the updated state of the DB.
+    The full state is only sent on connection (or on request).
+    After that, clients get "task_added", "task_changed" and "task_removed"
+    changes with the affected row and the state version it leads to.
+    Changes are collected during a short window and sent together
+    in one "deltas" message per subscription group: clients can subscribe
+    to some machines and/or statuses and only get the changes of those.
     """
-    def __init__(self, db_path="tasks.db"):
+    def __init__(self, db_path="tasks.db", broadcast_window=0.02,
+                max_pending=64, max_lag=10.0, host=WS_HOST, port=WS_PORT):
+        self.host = host
+        self.port = port
         # Connected clients
         self.clients = set()
+        # websocket -> its ClientConnection (outbound queue and writer)
+        self.connections = {}
+        # Messages waiting for a client before its state messages collapse,
+        # and seconds it can stay behind before being disconnected
+        self.max_pending = max_pending
+        self.max_lag = max_lag
         self.db_manager = DatabaseManager(db_path)
         self.task_manager = TaskManager(self.db_manager)
+        # The in-memory store is the one the server reads from.
+        # It is loaded only once, the DB is kept in sync on every change.
+        self.task_store = TaskStore()
+        self.task_store.load(self.task_manager.read_all_tasks())
+        # After loading, every DB operation runs on the storage thread
+        self.storage = AsyncStorage(self.db_manager)
+        # How late the event loop wakes up (time it was blocked)
+        self.loop_stats = {"samples": 0, "last_ms": 0.0, "max_ms": 0.0, "total_ms": 0.0}
+        # Increases by one with every change sent to the clients
+        self.state_version = 0
+        # Versions only mean something for this run of the server:
+        # clients present both to resume after a reconnection
+        self.epoch = uuid.uuid4().hex
+        # (version, task_id) of the last changes sent
+        self.history = deque(maxlen=HISTORY_SIZE)
+        # Seconds that changes are collected before broadcasting them
+        self.broadcast_window = broadcast_window
+        # Pending broadcast (None if there is none)
+        self._broadcast_task = None
+        self.broadcast_stats = {"requested": 0, "sent": 0, "coalesced": 0}
+        # Clients grouped by subscription (every client starts subscribed to all)
+        self.subscriptions = SubscriptionIndex()
+        # Subscription key -> version of the last "deltas" sent to that group
+        self.group_versions = {}
+        # task_id -> (machine, status) as last broadcast, to know which
+        # groups had a task that no longer belongs to their subscription
+        self._routed = {
+            task.task_id: (task.machine, task.status)
+            for task in self.task_store.tasks.values()
+        }
+        # Every start, modify and delete goes through this one timer
+        self.completions = CompletionScheduler(self._on_tasks_due)
+
+        # machine -> deque of "On queue" task_ids (FIFO)
+        self.machine_queues = {}
+        # machine -> task_id of its "In progress" task
+        self.running_tasks = {}
+        # Machines that may be able to start a task on the next pass
+        self.machines_to_check = set()
+        self.load_machine_queues()
+        # task_id / machine -> operations changing it that are being saved.
+        # Until they are, their changes are not broadcast and their machines
+        # start no task: if saving fails they are undone
+        self._unsaved_tasks = {}
+        self._unsaved_machines = {}
+
+        # Set on "run"
+        self.loop = None
+        self._server = None
+        self._stopped = None
+        self._monitor_task = None
+        self._shutting_down = False
 
-        self.machines_tasks_dict = {}
-        
 
     async def handler(self, websocket):
+        """
+        Serve a client until it disconnects.
+        The URI can carry the client's options, so it gets the right first
+        message without asking again after connecting:
+            ?encoding=compact&machines=A,B&statuses=On queue&epoch=...&version=42
+        With the epoch and version of its last state, a reconnecting client
+        gets only the changes it missed (if they are still on the history).
+        """
+        options = self._connection_options(websocket)
         # New client connects
         self.clients.add(websocket)
+        self.subscriptions.subscribe(
+                websocket,
+                options.get("machines"),
+                options.get("statuses")
+        )
+        self.connections[websocket] = ClientConnection(
+                websocket,
+                lambda: self.snapshot_message(websocket),
+                self.max_pending,
+                self.max_lag
+        )
+        if options.get("encoding") in ENCODINGS:
+            self.connections[websocket].encoding = options["encoding"]
         # Print the remote address and port
         if hasattr(websocket, "remote_address") and websocket.remote_address:
             print(f"Client connected from {websocket.remote_address}")
         else:
             print("Client connected (address unknown)")
         try:
-            # Send current state to new client
-            await self.send_state(websocket)
+            # Send current state (or what it missed) to new client
+            if options.get("epoch") == self.epoch and "version" in options:
+                await self.send_resume(websocket, options["version"])
+            else:
+                await self.send_state(websocket)
             # Listen for messages from this client
             async for message in websocket:
-                await self.process_message(message)
-                await self.broadcast_state()
+                await self.process_message(message, websocket)
+                self.schedule_broadcast()
         except Exception as e:
             print(f"WebSocket handler error: {e}")
         finally:
             print()
             self.clients.remove(websocket)
+            self.subscriptions.unsubscribe(websocket)
+            self.connections.pop(websocket).close()
 
     
-    async def process_message(self, message):
+    @staticmethod
+    def _connection_options(websocket):
+        """Options on the query string of the URI the client connected to."""
+        request = getattr(websocket, "request", None)
+        if request is None:
+            return {}
+        query = parse_qs(urlparse(request.path).query)
+        options = {}
+        for name in ("encoding", "epoch"):
+            if name in query:
+                options[name] = query[name][0]
+        for name in ("machines", "statuses"):
+            if name in query:
+                options[name] = [value for value in query[name][0].split(",") if value]
+        if "version" in query:
+            try:
+                options["version"] = int(query["version"][0])
+            except ValueError:
+                pass
+        return options
+
+    async def process_message(self, message, websocket=None):
         """
         Process a message from a client: create, update, or delete a task.
-        Depending on the action, a different query is prepared.
-        The query is filled with the params.
+        The in-memory store is changed first, then the change is saved
+        on the storage thread while the loop keeps serving other clients.
+        "snapshot" sends the full state back to the client that asked.
+        "query" sends back a page of the tasks (filtered and sorted on the DB).
+        "subscribe" sets the machines and/or statuses a client receives and
+        sends it a snapshot of only those.
+        "encoding" switches the state messages of a client to another
+        encoding (see utils.encoding) and sends it a snapshot in it.
+        "batch" runs a list of create, update and delete operations.
+        "stats" sends back the server's metrics (see "server_stats").
+        A message with a "request_id" always gets one reply with it:
+            {"type": "ack", "request_id", "action", "result": {...}}
+            {"type": "error", "request_id", "action", "error": "..."}
+        The ack is sent once the change is saved. Query pages and batch
+        results go in its "result" instead of their own message.
         """
         data = json.loads(message)
         action = data.get("action")
         params = data.get("params", {})
+        request_id = data.get("request_id")
+        if request_id is None:
+            await self._process_action(action, params, websocket)
+            return
+
+        try:
+            result = await self._process_action(action, params, websocket, reply=False)
+        except Exception as e:
+            print(f"Error processing {action}: {e}")
+            reply = {"type": "error", "request_id": request_id,
+                    "action": action, "error": str(e)}
+        else:
+            reply = {"type": "ack", "request_id": request_id,
+                    "action": action, "result": result or {}}
+        if websocket is not None:
+            await self.send_to(websocket, json.dumps(reply))
+
+    async def _process_action(self, action, params, websocket=None, reply=True):
+        """
+        Run an action. Returns its result for the ack.
+        "reply" sends query pages and batch results as their own messages.
+        """
+        if action in ("create", "update", "delete"):
+            before = self._task_copy(params.get("task_id")) if action != "create" else None
+            task_id, function, args = self._apply_operation(action, params)
+            held = self._hold([(task_id, before)])
+            try:
+                await self.storage.run(function, *args)
+            except Exception:
+                # Not saved: the store goes back to how it was before
+                self._revert_task(task_id, before)
+                raise
+            finally:
+                self._release(held)
+            return {"task_id": task_id}
+        if action == "batch":
+            results = await self.process_batch(
+                    params.get("operations", []),
+                    websocket if reply else None
+            )
+            return {"results": results}
+        if action == "save_time_left":
+            # Save the current state of the tasks, all in one transaction
+            times_left = [
+                    (t["task_id"], t["time_left"])
+                    for t in params.get("tasks", [])
+                    if self.task_store.get(t["task_id"]) is not None
+            ]
+            for task_id, time_left in times_left:
+                self.task_store.update(task_id, {"time_left": time_left})
+            await self.storage.run(self.task_manager.update_tasks_time_left, times_left)
+        elif action == "snapshot" and websocket is not None:
+            await self.send_snapshot(websocket)
+        elif action == "encoding" and websocket in self.connections:
+            if params.get("encoding") in ENCODINGS:
+                self.connections[websocket].encoding = params["encoding"]
+            await self.send_snapshot(websocket)
+        elif action == "query":
+            page = await self.query_page(params)
+            if not reply:
+                return page
+            if websocket is not None:
+                await self.send_to(websocket, json.dumps(dict(page, type="query_result")))
+        elif action == "stats":
+            stats = self.server_stats()
+            if not reply:
+                return stats
+            if websocket is not None:
+                await self.send_to(websocket, json.dumps(dict(stats, type="stats")))
+        elif action == "subscribe" and websocket is not None:
+            self.subscriptions.subscribe(
+                    websocket,
+                    params.get("machines"),
+                    params.get("statuses")
+            )
+            await self.send_snapshot(websocket)
+        elif not reply:
+            raise ValueError(f"Unknown action: {action}")
+        return {}
+
+    async def process_batch(self, operations, websocket=None):
+        """
+        Apply an ordered list of {"action": "create" | "update" | "delete",
+        "params": {...}} operations.
+        Every operation is applied in memory, then all of them are saved
+        in a single transaction. If saving fails nothing is saved, the
+        in-memory changes are undone and every operation is reported failed.
+        The scheduling pass and the broadcast run once after the whole batch
+        (like after any other message).
+        The results go in the ack; a message without a "request_id"
+        gets them as a "batch_result" instead.
+        """
+        results = []
+        db_operations = []
+        # (task_id, copy before the batch) of every operation applied
+        undo = []
+        for index, operation in enumerate(operations):
+            params = operation.get("params", {})
+            try:
+                before = self._task_copy(params.get("task_id")) \
+                        if operation.get("action") != "create" else None
+                task_id, function, args = self._apply_operation(
+                        operation.get("action"),
+                        params
+                )
+            except Exception as e:
+                # A failed operation does not stop the others
+                results.append({"index": index, "ok": False, "error": str(e)})
+                continue
+            results.append({"index": index, "ok": True, "task_id": task_id})
+            db_operations.append((function, args))
+            undo.append((task_id, before))
+
+        held = self._hold(undo)
+        try:
+            await self.storage.run(self._save_batch, db_operations)
+        except Exception as e:
+            print(f"Error saving the batch: {e}")
+            for task_id, before in reversed(undo):
+                self._revert_task(task_id, before)
+            for result in results:
+                if result["ok"]:
+                    result.update(ok=False, error=f"Failed to save the batch: {e}")
+                    del result["task_id"]
+        finally:
+            self._release(held)
+
+        if websocket is not None:
+            await self.send_to(
+                    websocket,
+                    json.dumps({"type": "batch_result", "results": results})
+            )
+        return results
+
+    def _task_copy(self, task_id):
+        """A task as it is now and its place on its machine's queue (or None)."""
+        task = self.task_store.get(task_id)
+        if task is None:
+            return None
+        position = None
+        if task.status == "On queue":
+            position = self.machine_queues[task.machine].index(task_id)
+        return TaskModel.from_row(task.to_tuple()), position
+
+    def _hold(self, operations):
+        """
+        Mark the tasks and machines of (task_id, copy before) operations
+        as unsaved. Returns what "_release" needs once the save is done.
+        """
+        task_ids = [task_id for task_id, _ in operations]
+        machines = set()
+        for task_id, before in operations:
+            task = self.task_store.get(task_id)
+            if task is not None:
+                machines.add(task.machine)
+            if before is not None:
+                machines.add(before[0].machine)
+        for task_id in task_ids:
+            self._unsaved_tasks[task_id] = self._unsaved_tasks.get(task_id, 0) + 1
+        for machine in machines:
+            self._unsaved_machines[machine] = self._unsaved_machines.get(machine, 0) + 1
+        return task_ids, machines
+
+    def _release(self, held):
+        """The save is done (or undone): its changes can be broadcast."""
+        task_ids, machines = held
+        for unsaved, keys in ((self._unsaved_tasks, task_ids),
+                (self._unsaved_machines, machines)):
+            for key in keys:
+                unsaved[key] -= 1
+                if not unsaved[key]:
+                    del unsaved[key]
+        self.schedule_broadcast()
+
+    def _revert_task(self, task_id, before):
+        """Put a task back as "_task_copy" saw it (None: it did not exist)."""
+        task = self.task_store.get(task_id)
+        if task is not None:
+            self.completions.cancel(task_id)
+            self._unqueue(task)
+            self.task_store.remove(task_id)
+        if before is None:
+            # A snapshot sent meanwhile may have had it
+            self.task_store.mark_removed(task_id)
+            return
+        task, position = before
+        self.task_store.add(task)
+        if task.status == "On queue":
+            self.machine_queues.setdefault(task.machine, deque()).insert(position, task_id)
+            self.machines_to_check.add(task.machine)
+        elif task.status == "In progress":
+            self.running_tasks[task.machine] = task_id
+            self.completions.schedule(task_id, self._expected_complete_epoch(task))
+
+    def _save_batch(self, db_operations):
+        """Run the DB operations of a batch in one transaction (storage thread)."""
+        with self.task_manager.batch():
+            for function, args in db_operations:
+                function(*args)
+
+    def _apply_operation(self, action, params):
+        """
+        Apply a create, update or delete on the in-memory store.
+        Returns (task_id, function, args) of the DB operation that saves it.
+        """
         if action == "create":
+            # Rejected here, instead of failing when the task starts
+            try:
+                params = dict(
+                        params,
+                        speed=int(params["speed"]),
+                        time_left=int(params["time_left"])
+                )
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("A task needs an integer speed and time_left")
+            if not params.get("machine"):
+                raise ValueError("A task needs a machine")
             # Convert params dict to TaskModel
             task_model = TaskModel(**params)
-            self.task_manager.create_task(task_model)
-        elif action == "update":
-            self.task_manager.update_task(params)
-        elif action == "delete":
-            self.task_manager.delete_task(params["task_id"])
-        elif action == "save_time_left":
-            # Save the current state of the tasks
-            for t in params.get("tasks", []):
-                self.task_manager.update_task_time_left(t["task_id"], t["time_left"])
+            task_model.task_id = self._unique_task_id(task_model.task_id)
+            self.task_store.add(task_model)
+            self._enqueue(task_model)
+            # A copy, the one in the store keeps changing
+            return (
+                task_model.task_id,
+                self.task_manager.create_task,
+                (TaskModel.from_row(task_model.to_tuple()),)
+            )
+        if action == "update":
+            task = self.task_store.get(params["task_id"])
+            if task is None:
+                raise ValueError(f"Task {params['task_id']} does not exist")
+            old_machine = task.machine
+            # The time left and the speed are the ones on the store (the
+            # server's clock for a started task): another station may have
+            # changed them after this client read them
+            params = dict(params, time_left=task.remaining_time, old_speed=task.speed)
+            changes = self.task_manager.update_changes(params)
+            self.task_store.update(params["task_id"], changes)
+            # A queued task can be moved to another machine's queue
+            if task.status == "On queue" and task.machine != old_machine:
+                self.machine_queues[old_machine].remove(task.task_id)
+                self._enqueue(task)
+            # A new speed moves the completion of a started task
+            if task.status == "In progress":
+                self.completions.schedule(
+                        task.task_id,
+                        self._expected_complete_epoch(task)
+                )
+            return task.task_id, self.task_manager.save_task_changes, (task.task_id, changes)
+        if action == "delete":
+            task = self.task_store.get(params["task_id"])
+            if task is None:
+                raise ValueError(f"Task {params['task_id']} does not exist")
+            # Out of the queues first: if that fails the task is still there
+            self._unqueue(task)
+            self.completions.cancel(task.task_id)
+            self.task_store.remove(task.task_id)
+            return params["task_id"], self.task_manager.delete_task, (params["task_id"],)
+        raise ValueError(f"Unknown action: {action}")
 
     async def send_state(self, websocket):
         """
@@ -78,167 +468,462 @@ class WebSocketServer:
         This exists aside of "broadcast_state" as it is used only
         when a new connection happens, getting the current state.
         """
-        tasks = self.task_manager.read_all_tasks()
-        message = json.dumps(
-                {
-                    "type": "state",
-                    "tasks": tasks
-                }
-        )
+        await self.send_snapshot(websocket)
 
-        self.create_machine_queues_dict()
-        self.start_tasks_in_progress()
-        self.start_tasks_on_idle_machines()
-        await websocket.send(message)
+    async def send_snapshot(self, websocket):
+        """Send the tasks of the client's subscription and the state version."""
+        await self.send_to(websocket, self.snapshot_message(websocket), state=True)
 
+    async def send_resume(self, websocket, version):
+        """
+        Send a reconnecting client only the changes after its version.
+        If they are no longer on the history, it gets a snapshot instead.
+        """
+        oldest = self.history[0][0] if self.history else self.state_version + 1
+        if version > self.state_version or version < oldest - 1:
+            await self.send_state(websocket)
+            return
+        await self.send_to(websocket, self.resume_message(websocket, version), state=True)
 
-    async def broadcast_state(self):
+    def resume_message(self, websocket, version):
         """
-        Broadcast the current state to all connected clients.
+        "deltas" from a version to the current one (serialized).
+        Every task changed since then is sent once, as it is now:
+        tasks that are gone, or out of the client's subscription, as removed.
         """
-        tasks = self.task_manager.read_all_tasks()
-        message = json.dumps(
+        # task_id -> version of its last change
+        latest = {}
+        for change_version, task_id in reversed(self.history):
+            if change_version <= version:
+                break
+            latest.setdefault(task_id, change_version)
+        key = self.subscriptions.key_of(websocket)
+        changes = []
+        for task_id, change_version in sorted(latest.items(), key=lambda item: item[1]):
+            task = self.task_store.get(task_id)
+            if task is not None and (key is None
+                    or SubscriptionIndex.matches(key, task.machine, task.status)):
+                changes.append({
+                    "type": "task_changed",
+                    "version": change_version,
+                    "task": task.to_row()
+                })
+            else:
+                changes.append({
+                    "type": "task_removed",
+                    "version": change_version,
+                    "task_id": task_id
+                })
+        connection = self.connections.get(websocket)
+        return encode(
+                {
+                    "type": "deltas",
+                    "base_version": version,
+                    "version": self.state_version,
+                    "changes": changes
+                },
+                connection.encoding if connection is not None else JSON
+        )
+
+    def snapshot_message(self, websocket):
+        """Snapshot of the tasks of the client's subscription, in its encoding."""
+        key = self.subscriptions.key_of(websocket)
+        if key is None or key == SubscriptionIndex.make_key():
+            rows = self.task_store.rows()
+        else:
+            rows = [
+                task.to_row() for task in self.task_store.tasks.values()
+                if SubscriptionIndex.matches(key, task.machine, task.status)
+            ]
+        connection = self.connections.get(websocket)
+        return encode(
                 {
                     "type": "state",
-                    "tasks": tasks
-                }
+                    "epoch": self.epoch,
+                    "version": self.state_version,
+                    "tasks": rows
+                },
+                connection.encoding if connection is not None else JSON
         )
-        await asyncio.gather(
-                *(
-                    client.send(message)
-                    for client in self.clients
-                    if getattr(client, "protocol", None)
-                            and client.protocol.state == OPEN
-                )
+
+    async def send_to(self, websocket, message, state=False):
+        """
+        Queue a message for a client (its writer sends it).
+        "state" messages can be collapsed if the client falls behind.
+        """
+        connection = self.connections.get(websocket)
+        if connection is None:
+            # Not a client of the handler, send it right away
+            await websocket.send(message)
+        else:
+            connection.put(message, state)
+
+    def server_stats(self):
+        """
+        Metrics of the running server, for the "stats" action:
+        event loop stalls, broadcasts requested/sent/coalesced, storage
+        commits and the queue of every client.
+        """
+        return {
+            "loop": dict(self.loop_stats),
+            "broadcast": dict(self.broadcast_stats),
+            "storage": dict(self.storage.stats),
+            "clients": self.client_stats(),
+            "version": self.state_version,
+            "tasks": len(self.task_store.tasks),
+        }
+
+    def client_stats(self):
+        """Queue depth, sent, dropped and resync counts of every client."""
+        return [
+            dict(
+                connection.stats,
+                address=str(getattr(websocket, "remote_address", "")),
+                depth=connection.depth
+            )
+            for websocket, connection in self.connections.items()
+        ]
+
+
+    async def query_page(self, params):
+        """
+        A page of the tasks that pass the filters and how many there are.
+        It runs on the storage thread, after the writes already queued,
+        so the page includes every change made before the query.
+        """
+        rows, total = await self.storage.run(
+                self.task_manager.query_tasks,
+                params.get("filters"),
+                params.get("sort", "task_id"),
+                params.get("descending", False),
+                params.get("offset", 0),
+                params.get("limit", 100)
         )
+        return {
+            "version": self.state_version,
+            "offset": max(0, int(params.get("offset", 0))),
+            "total": total,
+            # Rows as the store sends them (time left of running tasks)
+            "tasks": [TaskModel.from_row(row).to_row() for row in rows]
+        }
 
-        self.create_machine_queues_dict()
-        self.start_tasks_on_idle_machines()
-        
 
+    def schedule_broadcast(self):
+        """
+        Ask for a broadcast.
+        If one is already waiting, this change will go with it.
+        """
+        self.broadcast_stats["requested"] += 1
+        if self._broadcast_task is not None:
+            self.broadcast_stats["coalesced"] += 1
+            return
+        self._broadcast_task = asyncio.create_task(self._broadcast_after_window())
+
+    async def _broadcast_after_window(self):
+        """Wait for the window to close, then run the scheduling and broadcast."""
+        await asyncio.sleep(self.broadcast_window)
+        try:
+            # Tasks started here are sent in this same broadcast
+            self.start_tasks_on_idle_machines()
+        finally:
+            # Even if the pass fails, later changes must get their broadcast
+            self._broadcast_task = None
+        await self.broadcast_state()
 
-    def run(self):
+    async def broadcast_state(self):
         """
-        Start the WebSocket server (blocking call).
-        Should be run in a background thread if used with a GUI.
+        Broadcast the changes since the last broadcast to the connected clients.
+        Only the affected rows are sent, all of them in a single message
+        that is serialized once per subscription group.
+        A task that leaves a subscription (new machine or status) is sent
+        to that group as "task_removed".
+        Messages are queued on every client's connection, nothing waits here.
+        """
+        # Subscription key -> changes for that group
+        group_changes = {}
+        # Changes that are still being saved wait for the next broadcast
+        for kind, task_id in self.task_store.drain_changes(self._unsaved_tasks):
+            self.state_version += 1
+            self.history.append((self.state_version, task_id))
+            old_route = self._routed.pop(task_id, None)
+            if kind == "task_removed":
+                removed = {"type": kind, "version": self.state_version, "task_id": task_id}
+                # Unknown tasks go to every group, clients ignore what they lack
+                targets = set(self.subscriptions.groups) if old_route is None \
+                        else self.subscriptions.matching_groups(*old_route)
+                for key in targets:
+                    group_changes.setdefault(key, []).append(removed)
+                continue
+
+            task = self.task_store.get(task_id)
+            self._routed[task_id] = (task.machine, task.status)
+            delta = {"type": kind, "version": self.state_version, "task": task.to_row()}
+            targets = self.subscriptions.matching_groups(task.machine, task.status)
+            for key in targets:
+                group_changes.setdefault(key, []).append(delta)
+            if old_route is not None:
+                left = self.subscriptions.matching_groups(*old_route) - targets
+                if left:
+                    removed = {
+                        "type": "task_removed",
+                        "version": self.state_version,
+                        "task_id": task_id
+                    }
+                    for key in left:
+                        group_changes.setdefault(key, []).append(removed)
+
+        sent = False
+        for key, changes in group_changes.items():
+            connections = [
+                self.connections[client]
+                for client in self.subscriptions.groups.get(key, ())
+                if client in self.connections
+                        and getattr(client, "protocol", None)
+                        and client.protocol.state == OPEN
+            ]
+            # The group got every change up to its last message,
+            # so that is the base of this one
+            base_version = self.group_versions.get(key, 0)
+            self.group_versions[key] = self.state_version
+            if not connections:
+                continue
+            payload = {
+                "type": "deltas",
+                "base_version": base_version,
+                "version": self.state_version,
+                "changes": changes
+            }
+            # Encoded once per encoding used in the group, every client
+            # of the group gets the same str/bytes object
+            messages = {}
+            for connection in connections:
+                if connection.encoding not in messages:
+                    messages[connection.encoding] = encode(payload, connection.encoding)
+                # Every writer sends it on its own, a slow client delays nobody
+                connection.put(messages[connection.encoding], state=True)
+            sent = True
+        if sent:
+            self.broadcast_stats["sent"] += 1
+
+
+    def run(self, handle_signals=False):
+        """
+        Start the WebSocket server (blocking call, see app/server.py).
+        With "handle_signals" (only on the main thread), SIGINT and SIGTERM
+        run "shutdown".
+        If the port is taken it raises OSError without touching the tasks.
         """
         async def start():
-            server = await websockets.serve(self.handler, WS_HOST, WS_PORT)
-            print(f"WebSocket server started on ws://{WS_HOST}:{WS_PORT}")
-            
-            await server.wait_closed()
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(start())
-        loop.run_forever()
-
-    def create_machine_queues_dict(self):
-        """
-        Creates a dictionary with machines are keys
-        and "On queue" tasks in a list for each machine. 
-        """
-        tasks = self.task_manager.read_all_tasks()
-        machines_tasks = {}
-        for task in tasks:
-            machine = task[2]
-            task_id = task[0]
-            status = task[5]
-            if machine not in machines_tasks:
-                machines_tasks[machine] = []
-            if status == "On queue":
-                machines_tasks[machine].append(task_id)
-        self.machines_tasks_dict = machines_tasks
+            self._stopped = asyncio.Event()
+            # Bind first: if another server has the port, the tasks are its own
+            try:
+                self._server = await websockets.serve(self.handler, self.host, self.port)
+            except OSError:
+                await asyncio.to_thread(self.storage.close)
+                self.db_manager.close()
+                raise
+            print(f"WebSocket server started on ws://{self.host}:{self.port}")
+            self._monitor_task = asyncio.create_task(self._monitor_event_loop())
+            if handle_signals:
+                self._handle_signals()
+            # Resume the tasks that were running and fill the idle machines
+            self.start_tasks_in_progress()
+            self.start_tasks_on_idle_machines()
+
+            await self._stopped.wait()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(start())
+        finally:
+            self.loop.close()
+
+    def _handle_signals(self):
+        """Shut down cleanly on SIGINT (Ctrl+C) and SIGTERM."""
+        def on_signal(*_):
+            print("Stopping the WebSocket server...")
+            self.loop.call_soon_threadsafe(
+                    lambda: asyncio.ensure_future(self.shutdown())
+            )
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(signal_number, on_signal)
+            except NotImplementedError:
+                # Windows: no signal handlers on the event loop
+                signal.signal(signal_number, on_signal)
+
+    async def shutdown(self):
+        """Checkpoint the running tasks, close the connections and the DB."""
+        if self._shutting_down:
+            return
+        self._shutting_down = True
+        self.checkpoint()
+        self.completions.clear()
+        self._monitor_task.cancel()
+        if self._broadcast_task is not None:
+            self._broadcast_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        # Wait for the queued writes without blocking the loop
+        await asyncio.to_thread(self.storage.close)
+        self.db_manager.close()
+        self._stopped.set()
+
+    def checkpoint(self):
+        """
+        Save the time left of the running tasks (one transaction).
+        It is only needed when the server stops: on the next start
+        the tasks continue with that time.
+        """
+        times_left = [
+                (task.task_id, task.remaining_time)
+                for task in self.task_store.tasks_by_status("In progress")
+        ]
+        for task_id, time_left in times_left:
+            self.task_store.update(task_id, {"time_left": time_left})
+        self.storage.defer(self.task_manager.update_tasks_time_left, times_left)
+
+    def _unique_task_id(self, task_id):
+        """
+        task_id is the primary key, but two tasks created on the same second
+        get the same one. Repeated ids get a "-n" suffix.
+        """
+        unique_id = task_id
+        suffix = 1
+        while self.task_store.get(unique_id) is not None:
+            suffix += 1
+            unique_id = f"{task_id}-{suffix}"
+        return unique_id
+
+    def load_machine_queues(self):
+        """
+        Builds the queue of every machine (config.json and the ones on the DB)
+        with its "On queue" tasks, and finds which task each one is running.
+        Only done once, the queues are kept up to date on every change after.
+        """
+        machines = [machine["name"] for machine in Utils.load_config()["machines"]]
+        machines += self.task_store.machines()
+        self.machine_queues = {machine: deque() for machine in machines}
+        for task in self.task_store.tasks_by_status("On queue"):
+            self.machine_queues[task.machine].append(task.task_id)
+        self.running_tasks = {
+                task.machine: task.task_id
+                for task in self.task_store.tasks_by_status("In progress")
+        }
+        self.machines_to_check = set(self.machine_queues)
+
+    def _enqueue(self, task):
+        """Add a queued task at the end of its machine's queue."""
+        self.machine_queues.setdefault(task.machine, deque()).append(task.task_id)
+        self.machines_to_check.add(task.machine)
+
+    def _unqueue(self, task):
+        """Take a deleted task out of the queue or free its machine."""
+        if task.status == "On queue":
+            self.machine_queues[task.machine].remove(task.task_id)
+        elif self.running_tasks.get(task.machine) == task.task_id:
+            del self.running_tasks[task.machine]
+            self.machines_to_check.add(task.machine)
 
     def start_tasks_on_idle_machines(self):
-        """Starts the first task (by order) on an idle machine."""
-        idle_machines = self.search_idle_machines()
-        for m in idle_machines:
-            if self.machines_tasks_dict.get(m, []) != []:
-                task = self.pop_first_task_id(m)
-                self.start_task(task)
-            else:
+        """
+        Starts the first task (by order) on an idle machine.
+        Only the machines that changed since the last pass are checked.
+        A task that cannot start stays first on its queue (it is tried again
+        on the next pass of its machine) and the next one starts instead.
+        """
+        # Machines with changes being saved are checked after the save
+        held = {m for m in self.machines_to_check if m in self._unsaved_machines}
+        for m in self.machines_to_check - held:
+            if m in self.running_tasks:
+                continue
+            queue = self.machine_queues.get(m)
+            if not queue:
                 print(f"The machine {m} is empty.")
+                continue
+            failed = []
+            while queue:
+                task_id = queue.popleft()
+                try:
+                    self.start_task(task_id)
+                    break
+                except Exception as e:
+                    # A broken task does not keep its machine idle
+                    print(f"Error starting task {task_id}: {e}")
+                    failed.append(task_id)
+            queue.extendleft(reversed(failed))
+        self.machines_to_check = held
 
     def start_tasks_in_progress(self):
         """Starts the tasks that are "In progress" when the server launches."""
-        tasks = self.search_running_machines()
-        for t in tasks:
-            self.start_task(t[0])
-
-
-
-    def search_idle_machines(self):
-        """Returns a list of machines that have no ongoing tasks."""
-        tasks = self.task_manager.read_all_tasks()
-        machines = set(task[2] for task in tasks)
-        busy_machines = set()
-        for task in tasks:
-            status = task[5]
-            if status == "In progress":
-                busy_machines.add(task[2])
-        idle_machines = list(machines - busy_machines)
-        return idle_machines
-
-    def search_running_machines(self):
-        """Searchs the machines with ongoing tasks."""
-        tasks = self.task_manager.read_all_tasks()
-        started_tasks = []
-        for t in tasks:
-            if t[5] == "In progress":
-                started_tasks.append(t)
-        return started_tasks
-
-    def pop_first_task_id(self, machine):
-        """Returns the task_id of the first task on the queue and unqueues it."""
-        tasks = self.machines_tasks_dict
-        return tasks[machine].pop(0)
-    
+        for task_id in list(self.running_tasks.values()):
+            self.start_task(task_id)
+
+
     def start_task(self, task_id):
         """
         Starts a task by updating its:
         - time left, status, timestamp_expected_complete
-        Calls the completion function with a timer.
+        Schedules its completion.
         """
-        task = self.task_manager.read_task(task_id)
+        task = self.task_store.get(task_id)
         time_left = int(task.time_left)
         time_started = task.timestamp_start
         
         if not time_started or "":
-            self.task_manager.update_task_start_parameters(time_left, task_id)
+            changes = self.task_manager.start_changes(time_left)
         else:
-            self.task_manager.update_task_continue_parameters(time_left, task_id)
+            changes = self.task_manager.continue_changes(time_left)
+        self.task_store.update(task_id, changes)
+        self.storage.defer(self.task_manager.save_task_changes, task_id, changes)
+        self.running_tasks[task.machine] = task_id
 
-        # Use create_task instead of asyncio.run to avoid event loop errors
-        asyncio.create_task(self._call_complete_task(task, time_left))
+        self.completions.schedule(task_id, self._expected_complete_epoch(task))
         # Notify all clients of the new state
-        asyncio.create_task(self.broadcast_state())
-
-    async def _call_complete_task(self, task, time):
-        """Completes a task after a given time and update timers."""
-        await asyncio.sleep(time)
-        self.update_tasks_timers()
-        self.complete_task(task)
-        self.update_tasks_timers()
-        
+        self.schedule_broadcast()
+
+    def _on_tasks_due(self, task_ids):
+        """
+        Completes the tasks whose time is over.
+        Their writes are queued together, so they share a transaction.
+        """
+        for task_id in task_ids:
+            task = self.task_store.get(task_id)
+            if task is not None and task.status == "In progress":
+                self.complete_task(task)
+
+    async def _monitor_event_loop(self, interval=0.1):
+        """
+        Sleeps for an interval and measures how late it wakes up.
+        That delay is the time the loop was blocked (stall time).
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            stall_ms = max(0.0, loop.time() - expected) * 1000
+            self.loop_stats["samples"] += 1
+            self.loop_stats["last_ms"] = stall_ms
+            self.loop_stats["max_ms"] = max(self.loop_stats["max_ms"], stall_ms)
+            self.loop_stats["total_ms"] += stall_ms
+
+    @staticmethod
+    def _expected_complete_epoch(task):
+        """Returns the expected completion of a task in epoch seconds."""
+        return task.timestamp_expected_complete / 1000
+
     def complete_task(self, task):
         """For completion, updates tasks
-        - status (Complete), time_left(""), timestamp_expected_complete(now)"""
-        self.task_manager.udpate_task_complete(task.task_id)
+        - status (Complete), time_left(None), timestamp_expected_complete(now)"""
+        changes = self.task_manager.complete_changes()
+        self.task_store.update(task.task_id, changes)
+        self.storage.defer(self.task_manager.save_task_changes, task.task_id, changes)
+        # The machine can start its next task
+        self.running_tasks.pop(task.machine, None)
+        self.machines_to_check.add(task.machine)
         # Notify all clients of the new state
-        asyncio.create_task(self.broadcast_state())
-
-
-    def update_tasks_timers(self):
-        """Refreshes tasks to show the remaining time at that point in time."""
-        tasks = self.task_manager.read_all_tasks()
-        for task in tasks:
-            if task[5] == "In progress":
-                task_id = task[0]
-                now = datetime.now()
-                time_expected = task[7]
-                new_time_left = datetime.strptime(time_expected, "%Y-%m-%d %H:%M:%S.%f") - now
-                int_new_time_left = int(new_time_left.total_seconds())
-                self.task_manager.update_task_time_left(task_id, int_new_time_left)
+        self.schedule_broadcast()
 
 
 
@@ -247,11 +932,42 @@ class WebSocketClient:
     WebSocket client for sending operations and receiving state updates.
     Connects to server, sends operations for the server to process,
     receives state updates from the server.
+    Deltas are checked against the last state version received:
+    old ones are ignored and a gap asks the server for a new snapshot.
+    If the connection drops it reconnects on its own (jittered exponential
+    backoff) presenting its last state version, so the server only sends
+    the changes it missed. Operations sent meanwhile wait on a bounded queue.
+    Every operation carries a request_id: "send" returns a Future with the
+    result of the server's ack (or its error), and the round trip of every
+    action goes to "latency" (p50/p95/p99).
     """
-    def __init__(self, on_state_callback, host=WS_HOST, port=WS_PORT):
+    def __init__(self, on_state_callback, host=WS_HOST, port=WS_PORT,
+                encoding=JSON, max_pending=256, min_backoff=0.5, max_backoff=30.0):
         self.uri = f"ws://{host}:{port}"
-        # Function to call with new state
+        # Encoding asked for the state messages (see utils.encoding)
+        self.encoding = encoding
+        # Machines and statuses subscribed to (None: any)
+        self.machines = None
+        self.statuses = None
+        # Function to call with every state message (snapshot or delta)
         self.on_state_callback = on_state_callback
+        # Version of the last state applied and the server run it belongs to
+        self.state_version = None
+        self.epoch = None
+        # Seconds to wait before reconnecting (doubles on every failure)
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        # (message, request_id) waiting for a connection.
+        # When it is full the oldest is dropped
+        self._outbound = deque(maxlen=max_pending)
+        # request_id -> (future, action, send time) of the requests without reply
+        self._requests = {}
+        self._request_ids = itertools.count(1)
+        self.latency = LatencyStats()
+        self.stats = {"connections": 0, "queued": 0, "dropped": 0}
+        self._closing = False
+        # Set while there is a connection to the server
+        self.connected = threading.Event()
         self.loop = asyncio.new_event_loop()
         threading.Thread(
                 target=self.loop.run_forever,
@@ -265,29 +981,189 @@ class WebSocketClient:
         # Start connection in the background
         asyncio.run_coroutine_threadsafe(self._connect(), self.loop)
 
+    def wait_connected(self, timeout=None):
+        """
+        Wait until the client is connected (it keeps retrying with backoff).
+        Returns False if it is not connected after "timeout" seconds.
+        """
+        return self.connected.wait(timeout)
+
+    def _connection_uri(self):
+        """URI with the options the server needs before its first message."""
+        options = {}
+        if self.encoding != JSON:
+            options["encoding"] = self.encoding
+        if self.machines:
+            options["machines"] = ",".join(self.machines)
+        if self.statuses:
+            options["statuses"] = ",".join(self.statuses)
+        if self.epoch is not None and self.state_version is not None:
+            options["epoch"] = self.epoch
+            options["version"] = self.state_version
+        return f"{self.uri}/?{urlencode(options)}" if options else self.uri
+
     async def _connect(self):
-        try:
-            self.ws = await websockets.connect(self.uri)
-            asyncio.create_task(self.receive())
-        except Exception as e:
-            print(f"WebSocket connection failed: {e}")
+        """Keep the client connected until "close" is called."""
+        failures = 0
+        while not self._closing:
+            try:
+                # A snapshot of a long history is bigger than the default 1 MiB
+                # Frames that are already compressed skip permessage-deflate
+                self.ws = await websockets.connect(
+                        self._connection_uri(),
+                        max_size=None,
+                        compression=None if self.encoding == COMPACT_ZLIB else "deflate"
+                )
+            except Exception as e:
+                failures += 1
+                # Exponential backoff with jitter, so clients do not come back at once
+                delay = min(self.max_backoff, self.min_backoff * 2 ** (failures - 1))
+                delay = random.uniform(delay / 2, delay)
+                print(f"WebSocket connection failed: {e}. Retrying in {delay:.1f} s")
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            self.stats["connections"] += 1
+            self.connected.set()
+            await self._flush_outbound()
+            await self.receive()
+            self.connected.clear()
+            self.ws = None
+            self._fail_sent_requests()
+
+    async def _flush_outbound(self):
+        """Send the operations queued while there was no connection."""
+        while self._outbound:
+            try:
+                await self.ws.send(self._outbound[0][0])
+            except Exception:
+                # Still queued, it goes on the next connection
+                return
+            self._outbound.popleft()
+
+    async def _send(self, message, request_id=None):
+        if self.ws is not None and not self._outbound:
+            try:
+                await self.ws.send(message)
+                return
+            except Exception as e:
+                print(f"WebSocket send error: {e}")
+        if len(self._outbound) == self._outbound.maxlen:
+            self.stats["dropped"] += 1
+            print("Outbound queue full, the oldest operation was dropped")
+            self._fail_request(
+                    self._outbound[0][1],
+                    ConnectionError("Dropped while disconnected")
+            )
+        self._outbound.append((message, request_id))
+        self.stats["queued"] += 1
+
+    async def _send_request(self, request_id, action, message, future):
+        self._requests[request_id] = (future, action, time.perf_counter())
+        await self._send(message, request_id)
+
+    def _resolve_request(self, data):
+        """Complete the future of a request with its ack or error."""
+        request = self._requests.pop(data.get("request_id"), None)
+        if request is None:
+            return
+        future, action, sent_at = request
+        self.latency.record(action, (time.perf_counter() - sent_at) * 1000)
+        if data["type"] == "ack":
+            future.set_result(data.get("result", {}))
+        else:
+            future.set_exception(RuntimeError(data.get("error", "Request failed")))
+
+    def _fail_request(self, request_id, error):
+        request = self._requests.pop(request_id, None)
+        if request is not None and not request[0].done():
+            request[0].set_exception(error)
+
+    def _fail_sent_requests(self):
+        """
+        The connection dropped: requests already sent may or may not have
+        been applied, their futures fail. Queued ones are sent on reconnection.
+        """
+        queued = {request_id for _, request_id in self._outbound}
+        for request_id in [r for r in self._requests if r not in queued]:
+            self._fail_request(
+                    request_id,
+                    ConnectionError("Connection lost before the server replied")
+            )
 
     async def receive(self):
         # Listen for messages from the server
         try:
             async for message in self.ws:
-                data = json.loads(message)
-                if data.get("type") == "state":
-                    self.on_state_callback(data["tasks"])
+                # Text frames are JSON, binary frames the compact encoding
+                data = decode(message)
+                message_type = data.get("type")
+                if message_type == "state":
+                    self.state_version = data.get("version")
+                    self.epoch = data.get("epoch")
+                    self.on_state_callback(data)
+                elif message_type == "deltas":
+                    await self._apply_deltas(data)
+                elif message_type in ("ack", "error"):
+                    self._resolve_request(data)
         except Exception as e:
             print(f"WebSocket receive error: {e}")
 
+    async def _apply_deltas(self, data):
+        """Pass the new changes on, resync if some were missed."""
+        if self.state_version is None or data["version"] <= self.state_version:
+            # No snapshot yet or already included in the last one
+            return
+        if data["base_version"] > self.state_version:
+            # Missed a change, the table cannot be trusted anymore
+            self.state_version = None
+            await self._send(json.dumps({"action": "snapshot", "params": {}}))
+            return
+        data["changes"] = [
+                change for change in data["changes"]
+                if change["version"] > self.state_version
+        ]
+        self.state_version = data["version"]
+        self.on_state_callback(data)
+
+    def subscribe(self, machines=None, statuses=None):
+        """
+        Receive only the tasks of some machines and/or statuses (None: any).
+        The server answers with a snapshot of those tasks.
+        """
+        self.machines = machines or None
+        self.statuses = statuses or None
+        return self.send(
+                "subscribe",
+                {"machines": machines or [], "statuses": statuses or []}
+        )
+
+    def send_batch(self, operations):
+        """
+        Send several operations in one message:
+        [{"action": "create" | "update" | "delete", "params": {...}}, ...]
+        They are saved together and broadcast once.
+        The result of the Future has the "results" of every operation.
+        """
+        return self.send("batch", {"operations": operations})
+
     def send(self, action, params):
-        # Send an operation to the server
-        message = json.dumps({"action": action, "params": params})
-        asyncio.run_coroutine_threadsafe(self.ws.send(message), self.loop)
+        """
+        Send an operation to the server (queued if it is not connected).
+        Returns a concurrent Future: its result is the "result" of the ack,
+        or it raises RuntimeError with the server's error.
+        """
+        future = Future()
+        request_id = str(next(self._request_ids))
+        message = json.dumps({"action": action, "params": params, "request_id": request_id})
+        asyncio.run_coroutine_threadsafe(
+                self._send_request(request_id, action, message, future),
+                self.loop
+        )
+        return future
 
     def close(self):
-        # Close the websocket connection
+        # Close the websocket connection, without reconnecting
+        self._closing = True
         if self.ws:
-            asyncio.run_coroutine_threadsafe(self.ws.close(), self.loop)
\ No newline at end of file
+            asyncio.run_coroutine_threadsafe(self.ws.close(), self.loop)
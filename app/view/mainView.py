@@ -1,18 +1,31 @@
 import tkinter as tk
 from tkinter import ttk
 
+from model.taskTableModel import TaskTableModel
 from utils.utils import Utils
 
+# Height of a row of the table (pixels), used to know how many fit
+ROW_HEIGHT = 20
+# Rows put on the Treeview above and below the visible ones
+OVERSCAN_ROWS = 10
+
 
 class MainView():
-    def __init__(self, root):
+    def __init__(self, root, table_model=None):
         self.window = root
+        # Every task is kept on the model, only the visible window
+        # of rows is put on the Treeview (virtualized table)
+        self.table_model = table_model or TaskTableModel()
+        # Position (on the model) of the first visible row
+        self.first_row = 0
+        # Rows that fit on the table, updated when it is resized
+        self.visible_rows = 15
         self.window.title("Main View")
-        self.window.geometry("780x500")
+        self.window.geometry("780x560")
         self.window.resizable(False, False)
 
         # Center the window on the screen
-        Utils.center_window_on_screen(self.window, 780, 500)
+        Utils.center_window_on_screen(self.window, 780, 560)
 
         # Create a frame for the main view
         self.main_frame = ttk.Frame(self.window)
@@ -24,17 +37,117 @@ class MainView():
         self._on_modify_task = None
         self._on_delete_task = None
         self._on_column_click = None
+        self._on_filter = None
+
+        # task_id -> values shown on its row, to skip rows that did not change
+        # Only the rows that are on the Treeview
+        self._row_values = {}
+        # task_id of the selected row. Kept while the row is scrolled out of
+        # the Treeview, so it is selected again when it comes back
+        self.selected_task_id = None
 
         # Create the elements of the main view
+        self._create_filter_bar()
         self._create_table()
+        # Packed before the buttons, so it is the bottom line
+        self._create_status_bar()
         self._create_buttons()
         self._set_style()
 
+    # Filters for the table
+    def _create_filter_bar(self):
+        """
+        Filters over the columns. Comboboxes filter when a value is selected,
+        entries when Enter is pressed (or on "Filter").
+        """
+        self.filter_frame = ttk.Frame(self.main_frame, padding=5)
+        self.filter_frame.pack(fill=tk.X, side=tk.TOP)
+
+        # First row: task ID prefix, machine, material and status
+        ttk.Label(self.filter_frame, text="Task ID").grid(row=0, column=0, sticky=tk.W, padx=2)
+        self.task_id_entry = ttk.Entry(self.filter_frame, width=10)
+        self.task_id_entry.grid(row=0, column=1, sticky=tk.EW, padx=2, pady=2)
+
+        ttk.Label(self.filter_frame, text="Machine").grid(row=0, column=2, sticky=tk.W, padx=2)
+        self.machine_filter_combo = ttk.Combobox(self.filter_frame, state="readonly", width=20)
+        self.machine_filter_combo.grid(row=0, column=3, columnspan=3, sticky=tk.EW, padx=2, pady=2)
+
+        ttk.Label(self.filter_frame, text="Material").grid(row=0, column=6, sticky=tk.W, padx=2)
+        self.material_filter_combo = ttk.Combobox(self.filter_frame, state="readonly", width=14)
+        self.material_filter_combo.grid(row=0, column=7, sticky=tk.EW, padx=2, pady=2)
+
+        ttk.Label(self.filter_frame, text="Status").grid(row=0, column=8, sticky=tk.W, padx=2)
+        self.status_filter_combo = ttk.Combobox(self.filter_frame, state="readonly", width=11)
+        self.status_filter_combo.grid(row=0, column=9, sticky=tk.EW, padx=2, pady=2)
+
+        # Second row: speed and started at ranges
+        ttk.Label(self.filter_frame, text="Speed").grid(row=1, column=0, sticky=tk.W, padx=2)
+        self.speed_min_entry = ttk.Entry(self.filter_frame, width=10)
+        self.speed_min_entry.grid(row=1, column=1, sticky=tk.EW, padx=2, pady=2)
+        ttk.Label(self.filter_frame, text="to").grid(row=1, column=2, padx=2)
+        self.speed_max_entry = ttk.Entry(self.filter_frame, width=6)
+        self.speed_max_entry.grid(row=1, column=3, sticky=tk.EW, padx=2, pady=2)
+
+        ttk.Label(self.filter_frame, text="Started").grid(row=1, column=4, sticky=tk.W, padx=2)
+        self.started_from_entry = ttk.Entry(self.filter_frame, width=11)
+        self.started_from_entry.grid(row=1, column=5, sticky=tk.EW, padx=2, pady=2)
+        ttk.Label(self.filter_frame, text="to").grid(row=1, column=6, padx=2)
+        self.started_to_entry = ttk.Entry(self.filter_frame, width=11)
+        self.started_to_entry.grid(row=1, column=7, sticky=tk.EW, padx=2, pady=2)
+
+        self.filter_button = ttk.Button(self.filter_frame, text="Filter",
+                command=self.on_filter)
+        self.filter_button.grid(row=1, column=8, sticky=tk.EW, padx=2, pady=2)
+        self.clear_filter_button = ttk.Button(self.filter_frame, text="Clear",
+                command=self.clear_filters)
+        self.clear_filter_button.grid(row=1, column=9, sticky=tk.EW, padx=2, pady=2)
+
+        for combo in (self.machine_filter_combo, self.material_filter_combo,
+                self.status_filter_combo):
+            combo.bind("<<ComboboxSelected>>", lambda e: self.on_filter())
+        for entry in (self.task_id_entry, self.speed_min_entry, self.speed_max_entry,
+                self.started_from_entry, self.started_to_entry):
+            entry.bind("<Return>", lambda e: self.on_filter())
+
+    def set_filter_options(self, machines, materials, statuses):
+        """Values of the comboboxes. The empty one means "any"."""
+        self.machine_filter_combo["values"] = [""] + list(machines)
+        self.material_filter_combo["values"] = [""] + list(materials)
+        self.status_filter_combo["values"] = [""] + list(statuses)
+
+    def get_filters(self):
+        """Returns the text of every filter, as written."""
+        return {
+            "task_id": self.task_id_entry.get().strip(),
+            "machine": self.machine_filter_combo.get(),
+            "material": self.material_filter_combo.get(),
+            "status": self.status_filter_combo.get(),
+            "speed_min": self.speed_min_entry.get().strip(),
+            "speed_max": self.speed_max_entry.get().strip(),
+            "started_from": self.started_from_entry.get().strip(),
+            "started_to": self.started_to_entry.get().strip(),
+        }
+
+    def clear_filters(self):
+        """Empty every filter and show all the rows."""
+        for combo in (self.machine_filter_combo, self.material_filter_combo,
+                self.status_filter_combo):
+            combo.set("")
+        for entry in (self.task_id_entry, self.speed_min_entry, self.speed_max_entry,
+                self.started_from_entry, self.started_to_entry):
+            entry.delete(0, tk.END)
+        self.on_filter()
+
     # Table for displaying tasks
     def _create_table(self):
         # Create a treeview for displaying data
         columns = ("Task ID", "Started at", "Machine", "Material", "Speed", "Status", "Time left")
-        self.tree = ttk.Treeview(self.main_frame, columns=columns, show="headings", padding=5)
+        self.table_frame = ttk.Frame(self.main_frame)
+        self.table_frame.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(self.table_frame, columns=columns, show="headings", padding=5)
+        # The scrollbar moves over the model, not over the Treeview items
+        self.scrollbar = ttk.Scrollbar(self.table_frame, orient=tk.VERTICAL,
+                command=self._on_scrollbar)
 
         # Headings
         self.tree.heading("Task ID", text="Task ID",
@@ -61,10 +174,27 @@ class MainView():
         self.tree.column("Status", width=70)
         self.tree.column("Time left", width=70)
 
-        self.tree.pack(fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Scrolling is done by moving the window over the model
+        self.tree.bind("<Configure>", self._on_table_resize)
+        self.tree.bind("<MouseWheel>", self._on_mouse_wheel)
+        # Linux sends the wheel as buttons 4 and 5
+        self.tree.bind("<Button-4>", self._on_mouse_wheel)
+        self.tree.bind("<Button-5>", self._on_mouse_wheel)
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
 
 
     # Buttons for creating, modifying, and deleting tasks
+    def _create_status_bar(self):
+        """Line at the bottom for the state of the connection (round trips)."""
+        self.status_label = ttk.Label(self.main_frame, text="", padding=(5, 0))
+        self.status_label.pack(fill=tk.X, side=tk.BOTTOM)
+
+    def set_status(self, text):
+        self.status_label.config(text=text)
+
     def _create_buttons(self):
         # Create a frame for buttons
         self.button_frame = ttk.Frame(self.main_frame, padding=5)
@@ -97,20 +227,137 @@ class MainView():
 
 
     # Fill the table with data
+    def refresh(self):
+        """
+        Show the visible window of the model (plus some overscan rows).
+        Only that window is on the Treeview, whatever the model size.
+        """
+        total = len(self.table_model)
+        self.first_row = max(0, min(self.first_row, total - self.visible_rows))
+        start = max(0, self.first_row - OVERSCAN_ROWS)
+        end = min(total, self.first_row + self.visible_rows + OVERSCAN_ROWS)
+        self.populate_table(self.table_model.window(start, end - start))
+
+        # Put the first visible row at the top of the Treeview
+        if end > start:
+            self.tree.yview_moveto((self.first_row - start) / (end - start))
+        if total:
+            self.scrollbar.set(
+                    self.first_row / total,
+                    min(1.0, (self.first_row + self.visible_rows) / total)
+            )
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
     def populate_table(self, tasks):
-        """Populate the table with the tasks"""
-        # Clear previous values
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        # Add the tasks
+        """
+        Reconcile the Treeview with the tasks. The task_id is the item id:
+        new rows are inserted, changed cells updated, vanished rows removed
+        and rows moved only if they are not in their place.
+        The table is never cleared, so the selection is kept; a selected
+        row that left the window is selected again when it comes back.
+        """
+        incoming = {task[0]: task for task in tasks}
+        vanished = [iid for iid in self._row_values if iid not in incoming]
+        if vanished:
+            self.tree.delete(*vanished)
+            for iid in vanished:
+                del self._row_values[iid]
         for task in tasks:
-            self.tree.insert("", tk.END, values=task)
+            self.upsert_task(task)
+        if (self.selected_task_id in incoming
+                and self.selected_task_id not in self.tree.selection()):
+            self.tree.selection_set(self.selected_task_id)
+
+        children = self.tree.get_children()
+        for index, task in enumerate(tasks):
+            if index >= len(children) or children[index] != task[0]:
+                self.tree.move(task[0], "", index)
+                children = self.tree.get_children()
+
+    def upsert_task(self, task):
+        """
+        Add a task to the Treeview or update its row if any value changed.
+        Local changes the server has not confirmed yet are marked as pending.
+        """
+        values = tuple(self.format_row(task))
+        tags = ("pending",) if task[0] in self.table_model.pending else ()
+        current = self._row_values.get(task[0])
+        if current is None:
+            self.tree.insert("", tk.END, iid=task[0], values=values, tags=tags)
+        elif current != (values, tags):
+            self.tree.item(task[0], values=values, tags=tags)
+        self._row_values[task[0]] = (values, tags)
+
+    def _on_select(self, event=None):
+        """Remember the selected task (not when its row just left the window)."""
+        selection = self.tree.selection()
+        if selection:
+            self.selected_task_id = selection[0]
+        elif self.selected_task_id in self._row_values:
+            # Unselected by the user
+            self.selected_task_id = None
+
+    def is_shown(self, task_id):
+        """True if the row of the task is on the Treeview."""
+        return task_id in self._row_values
+
+    # Scrolling over the model
+    def scroll_rows(self, rows):
+        """Move the visible window some rows up (negative) or down."""
+        self.first_row += rows
+        self.refresh()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        """Handle the scrollbar: dragging ("moveto") or arrows/trough ("scroll")."""
+        if action == "moveto":
+            self.first_row = int(float(amount) * len(self.table_model))
+            self.refresh()
+        elif unit == "pages":
+            self.scroll_rows(int(amount) * self.visible_rows)
+        else:
+            self.scroll_rows(int(amount))
+
+    def _on_mouse_wheel(self, event):
+        """Scroll three rows per step. "break" stops the Treeview's own scroll."""
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.scroll_rows(-3)
+        else:
+            self.scroll_rows(3)
+        return "break"
+
+    def _on_table_resize(self, event):
+        """Recalculate how many rows fit on the table."""
+        # The headings take about one row
+        self.visible_rows = max(1, event.height // ROW_HEIGHT - 1)
+        self.refresh()
+
+    @staticmethod
+    def format_row(task):
+        """
+        Returns the values shown for a task row.
+        "Started at" is shown as a date and empty values as "".
+        Running tasks show the seconds left until their expected completion,
+        which is kept (epoch ms, hidden) for the countdown.
+        """
+        values = list(task)
+        values[1] = Utils.format_timestamp(values[1])
+        if values[5] == "In progress" and values[7] is not None:
+            values[6] = max(0, (values[7] - Utils.now_ms()) // 1000)
+        values[6] = "" if values[6] is None else values[6]
+        values[7] = "" if values[7] is None else values[7]
+        return values
 
     # Sort the data on the table
     def on_column_click(self, column):
         if self._on_column_click:
             self._on_column_click(column)
 
+    # Filter the data on the table
+    def on_filter(self):
+        if self._on_filter:
+            self._on_filter()
+
 
     # Callbacks for button clicks
     def set_on_create_task(self, callback):
@@ -125,6 +372,9 @@ class MainView():
     def set_on_column_click(self, callback):
         self._on_column_click = callback
 
+    def set_on_filter(self, callback):
+        self._on_filter = callback
+
 
     def _set_style(self):
         # Create the styles for the view
@@ -137,9 +387,12 @@ class MainView():
         style.configure(
                 "Treeview",
                 background="light slate grey",
-                fieldbackground="light slate grey"
+                fieldbackground="light slate grey",
+                rowheight=ROW_HEIGHT
         )
         style.configure(
                 "TLabel",
                 background="SkyBlue3"
-        )
\ No newline at end of file
+        )
+        # Rows changed here that the server has not confirmed yet
+        self.tree.tag_configure("pending", foreground="gray30")
\ No newline at end of file